@@ -0,0 +1,373 @@
+"""
+This program cleans [wx]3270 "Save screen to file" captures (x3scr.*.txt) of BROWSE sessions
+into the plain dataset content. It is the successor of clean_screen_log.pl, sharing the screen
+parsing with x3270scripting and x3270ispf modules. Logs are streamed, so their size does not matter,
+and overlapping pages are de-duplicated by the line numbers from the BROWSE header.
+Written by Andrej Pakhutin (pakhutin@gmail.com)
+"""
+import os
+import sys
+import argparse
+import glob
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Optional, Deque
+from x3270scripting import clean_screen_line
+from x3270ispf import BROWSE_HEADER_RE, BROWSE_MESSAGE_RE, COMMAND_LINE_RE
+
+# Screen separators put between the captures
+SEPARATOR_RE = re.compile(r'^(\s*\.){10,}\s*$|^={50,}')
+TOP_OF_DATA_RE = re.compile(r'\*{10,}\s*Top of Data', re.IGNORECASE)
+BOTTOM_OF_DATA_RE = re.compile(r'\*{10,}\s*Bottom of Data', re.IGNORECASE)
+
+# Rows above the BROWSE header (action bar and its underline), which look like data at the end of the previous screen
+CHROME_ROWS = 2
+
+
+#####################################################################
+class ScreenLogCleaner:
+    """
+    Line-by-line state machine turning screen captures into dataset lines.
+    Keeps only a couple of lines of lookahead, except for the horizontal mode which glues whole pages.
+    """
+    def __init__(self, horizontal: bool = False, trigraphs: bool = False):
+        self.dsname: str = ''  # from the first BROWSE header seen
+        self.messages: List[str] = []  # short messages shown in place of Line/Col
+        self.lines_out: int = 0
+        self.duplicates: int = 0
+        self.gaps: int = 0
+
+        self.__horizontal = horizontal
+        self.__trigraphs = trigraphs
+        self.__in_data = False
+        self.__line_no = -1  # record number of the next data row on the page, -1 if unknown
+        self.__next_no = 1  # the first record number that was not written yet
+        self.__row = 0  # data row on the current page
+        self.__pending: Deque[Tuple[int, int, str]] = deque()  # (row, record number, text)
+        self.__glue: List[str] = []
+        self.__header: Optional[Tuple[re.Match, str]] = None  # header-like row held back for one line
+
+    #####################################################################
+    def feed(self, raw: str) -> List[str]:
+        """
+        Processes one line of the capture
+        :param raw: line as read from the file
+        :return: list of ready output lines. Usually empty or one line
+        """
+        raw = raw.rstrip('\r\n')
+
+        if SEPARATOR_RE.match(raw):  # the end of a screen: the pending rows were the real data
+            out = self.__not_header()
+            self.__in_data = False
+            return out + self.__flush()
+
+        line = clean_screen_line(raw)
+
+        out: List[str] = []
+        if self.__header:
+            if self.__is_command_line(line):
+                self.__new_screen(self.__header[0])
+                self.__header = None
+                return []
+
+            out = self.__not_header()
+
+        # Data rows can look like a header too, so it is a header only if the command line follows
+        m = BROWSE_HEADER_RE.match(line) or BROWSE_MESSAGE_RE.match(line)
+        if m:
+            self.__header = (m, line)
+            return out
+
+        if not self.__in_data:  # a screen without a recognizable header
+            if self.__is_command_line(line):
+                self.__in_data = True
+                self.__row = 0
+                self.__line_no = -1
+            return out
+
+        return out + self.__data(line)
+
+    #####################################################################
+    @staticmethod
+    def __is_command_line(line: str) -> bool:
+        """
+        BROWSE command line: the label starts the row, the Scroll field follows
+        """
+        m = COMMAND_LINE_RE.match(line.lstrip())
+        return bool(m) and m.group('scroll') is not None
+
+    #####################################################################
+    def __not_header(self) -> List[str]:
+        """
+        The held back header-like row was not followed by the command line: it is data
+        """
+        if not self.__header:
+            return []
+
+        line = self.__header[1]
+        self.__header = None
+        return self.__data(line) if self.__in_data else []
+
+    #####################################################################
+    def __new_screen(self, m: re.Match) -> None:
+        self.__in_data = True
+        self.__row = 0
+        self.__pending.clear()  # the rows between the previous screen and this header are the chrome
+
+        if not self.dsname:
+            self.dsname = m.group('dsname')
+
+        gd = m.groupdict()
+        if gd.get('message'):
+            self.messages.append(gd['message'])
+            self.__line_no = -1
+        else:
+            self.__line_no = int(gd['line']) if gd.get('line') else -1
+
+    #####################################################################
+    def __data(self, line: str) -> List[str]:
+        if BOTTOM_OF_DATA_RE.search(line):
+            self.__in_data = False
+            return self.__flush()
+
+        if TOP_OF_DATA_RE.search(line):  # it takes the line number 0
+            if self.__line_no != -1:
+                self.__line_no += 1
+            self.__row += 1
+            return []
+
+        if self.__trigraphs:
+            line = line.replace('??(', '[').replace('??)', ']')
+
+        self.__pending.append((self.__row, self.__line_no, line))
+        self.__row += 1
+        if self.__line_no != -1:
+            self.__line_no += 1
+
+        if len(self.__pending) > CHROME_ROWS:
+            return self.__emit(*self.__pending.popleft())
+
+        return []
+
+    #####################################################################
+    def finish(self) -> List[str]:
+        """
+        Flushes the rest of data at the end of the capture
+        :return: list of output lines
+        """
+        out = self.__not_header()
+        out += self.__flush()
+
+        if self.__horizontal:
+            out = self.__glue
+            self.__glue = []
+            self.lines_out = len(out)
+
+        return out
+
+    #####################################################################
+    def __flush(self) -> List[str]:
+        out: List[str] = []
+        while self.__pending:
+            out += self.__emit(*self.__pending.popleft())
+
+        return out
+
+    #####################################################################
+    def __emit(self, row: int, line_no: int, text: str) -> List[str]:
+        if self.__horizontal:  # gluing wide pages, like IMS logs, by the screen row
+            while len(self.__glue) <= row:
+                self.__glue.append('')
+            self.__glue[row] += text
+            return []
+
+        if line_no != -1:
+            if line_no < self.__next_no:
+                self.duplicates += 1
+                return []
+
+            if line_no > self.__next_no:
+                self.gaps += 1
+
+            self.__next_no = line_no + 1
+
+        self.lines_out += 1
+        return [text]
+
+
+#####################################################################
+def process_file(in_fname: str, out_fname: str = '', out_dir: str = '.',
+                 horizontal: bool = False, trigraphs: bool = False) -> Tuple[str, int]:
+    """
+    Cleans one capture file.
+    :param in_fname: capture file name
+    :param out_fname: output file name. Derived from the dataset name in BROWSE header if empty
+    :param out_dir: where to put the output file with derived name
+    :param horizontal: glue wide, horizontally scrolled stuff like IMS logs
+    :param trigraphs: replace C trigraphs ??( and ??) with brackets
+    :return: output file name ('' if nothing was written) and the number of lines written
+    """
+    cleaner = ScreenLogCleaner(horizontal, trigraphs)
+    outfile = None
+
+    def out_file(lines: List[str]) -> None:
+        nonlocal outfile, out_fname
+        if not lines:
+            return
+
+        if outfile is None:
+            if not out_fname:
+                name = cleaner.dsname.lower() if cleaner.dsname else os.path.basename(in_fname) + '.cleaned.txt'
+                out_fname = os.path.join(out_dir, name)
+
+            if os.path.exists(out_fname):  # make sure we will not overwrite existing files
+                out_fname += '_' + str(time.time())
+
+            outfile = open(out_fname, 'w', buffering=1024 * 1024)
+
+        outfile.write('\n'.join(lines) + '\n')
+
+    with open(in_fname, 'r', errors='replace') as infile:
+        for raw in infile:
+            out_file(cleaner.feed(raw))
+
+    out_file(cleaner.finish())
+
+    if outfile is None:
+        print(f"! {in_fname}: no data found", file=sys.stderr)
+        return '', 0
+
+    outfile.close()
+
+    for msg in cleaner.messages:
+        print(f"* {in_fname}: Message: {msg}")
+
+    if cleaner.gaps:
+        print(f"! {in_fname}: {cleaner.gaps} gaps in line numbers. Some pages are missing", file=sys.stderr)
+
+    print(f"+ {in_fname} -> {out_fname}: {cleaner.lines_out} lines, {cleaner.duplicates} duplicates skipped")
+
+    return out_fname, cleaner.lines_out
+
+
+#####################################################################
+def process_dir(in_dir: str, out_dir: str = '.', workers: Optional[int] = None,
+                horizontal: bool = False, trigraphs: bool = False) -> List[Tuple[str, int]]:
+    """
+    Cleans all of the standard named captures (x3scr.*.txt) in a directory on a process pool
+    :param in_dir: directory to scan
+    :param out_dir: where to put the results
+    :param workers: number of processes. CPU count by default
+    :return: list of process_file() results
+    """
+    files = sorted(glob.glob(os.path.join(in_dir, 'x3scr.*.txt')))
+    if not files:
+        print(f"! No captures found in {in_dir}", file=sys.stderr)
+        return []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_file, f, '', out_dir, horizontal, trigraphs) for f in files]
+        return [f.result() for f in futures]
+
+
+#####################################################################
+def _capture_screen(first: int, rows: List[str]) -> List[str]:
+    """
+    Builds a BROWSE screen capture for self_test()
+    """
+    screen = ['  Menu  Utilities  Compilers  Help', '  ' + '-' * 76,
+              f'  BROWSE    ZUSER.TEST.CLIST(MEM)                   Line {first:010d} Col 001 080',
+              '  Command ===>                                                  Scroll ===> CSR'] + rows
+
+    return [f' . {line:<80} . ' for line in screen]
+
+
+#####################################################################
+def self_test() -> bool:
+    """
+    Cleans the synthetic captures: screens with and without separators, and data rows
+    that look like the BROWSE header and command line
+    :return: True if all checks passed
+    """
+    top = '*' * 30 + ' Top of Data ' + '*' * 30
+    bottom = '*' * 30 + ' Bottom of Data ' + '*' * 30
+    separator = ' .' * 42
+    clist = ['PROC 0', 'CONTROL NOLIST', 'EDIT MY.DATA(MEM) TEXT NONUM',
+             'BROWSE MY.DATA(MEM) Line 0000000001 Col 001 080',
+             'WRITE Command ===> X   Scroll ===> CSR', 'Command ===> Y   Scroll ===> PAGE', 'END', 'EXIT']
+    records = [f'REC{i}' for i in range(1, 14)]
+
+    cases = [
+        ('separators', records,
+         _capture_screen(0, [top] + records[:5]) + [separator] +
+         _capture_screen(6, records[5:10]) + [separator] +
+         _capture_screen(11, records[10:] + [bottom])),
+        ('header-like data', clist,
+         _capture_screen(0, [top] + clist[:4]) +
+         _capture_screen(4, clist[3:] + [bottom])),
+    ]
+
+    ok = True
+    for name, expected, capture in cases:
+        cleaner = ScreenLogCleaner()
+        out: List[str] = []
+        for raw in capture:
+            out += cleaner.feed(raw + '\n')
+        out += cleaner.finish()
+
+        if out != expected or cleaner.gaps or cleaner.messages:
+            print(f"clean_screen_log: {name}: got {out}, gaps: {cleaner.gaps}, messages: {cleaner.messages}",
+                  file=sys.stderr)
+            ok = False
+
+    return ok
+
+
+#####################################################################
+if __name__ == "__main__":
+    desktop = os.path.join(os.environ.get('USERPROFILE', os.path.expanduser('~')), 'Desktop')
+
+    parser = argparse.ArgumentParser(add_help=True,
+                                     description='Cleans [wx]3270 "Save screen to file" captures of BROWSE sessions.\n' +
+                                     'Made by Andrej Pakhutin. pakhutin@gmail.com')
+    parser.add_argument('files', nargs='*', help='Capture files. The 2nd one may be the output file name instead')
+    parser.add_argument('-a', '--all', nargs='?', const=desktop, default=None, dest='all',
+                        help='Process all x3scr.*.txt captures in the directory. Default is ' + desktop)
+    parser.add_argument('-j', '--jobs', type=int, default=None, dest='jobs',
+                        help='Number of parallel processes for -a. Default: CPU count')
+    parser.add_argument('-o', '--out-dir', default='.', dest='out_dir', help='Output directory. Default: current')
+    parser.add_argument('--self-test', action='store_true', dest='self_test',
+                        help='Clean the built-in synthetic captures and check the results')
+    parser.add_argument('-t', '--trigraphs', action='store_true', dest='trigraphs',
+                        help='Replace C trigraphs ??( and ??) with brackets')
+    parser.add_argument('-z', '--horizontal', action='store_true', dest='horizontal',
+                        help='Glue wide, horizontal stuff like IMS logs')
+
+    cmd_line = parser.parse_args()
+
+    if cmd_line.self_test:
+        if not self_test():
+            sys.exit(1)
+
+        print("clean_screen_log: self test OK")
+
+    elif cmd_line.all:
+        if cmd_line.files:
+            print("You can't use -a with file names")
+            sys.exit(1)
+
+        process_dir(cmd_line.all, cmd_line.out_dir, cmd_line.jobs, cmd_line.horizontal, cmd_line.trigraphs)
+
+    elif len(cmd_line.files) == 2 and not os.path.exists(cmd_line.files[1]):
+        process_file(cmd_line.files[0], cmd_line.files[1], horizontal=cmd_line.horizontal,
+                     trigraphs=cmd_line.trigraphs)
+
+    elif cmd_line.files:
+        for f in cmd_line.files:
+            process_file(f, '', cmd_line.out_dir, cmd_line.horizontal, cmd_line.trigraphs)
+
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,257 @@
+"""
+This module is a part of z/OS toolset interacting with 3270 terminal emulator
+by https://x3270.bgp.nu/ team.
+    The function is to transfer binary datasets at the text speed. HEX mode of BROWSE spends
+4 screen rows on every 79 bytes, so instead a small REXX exec encodes the dataset on the host
+into a temporary FB 80 dataset of base64 lines, which is then received as plain text and decoded here.
+    Encoded stream: for every record 2-byte length, 4-byte CRC-32 of the data, then the data itself.
+The stream ends with the trailer: X'FFFF' and 4-byte number of records.
+It is split into 57-byte chunks, each one written as a 76 characters base64 line.
+    Run this module to check the encoder/decoder round trip.
+Written by Andrej Pakhutin (pakhutin@gmail.com)
+"""
+import sys
+import base64
+import binascii
+import os
+import re
+import struct
+import zlib
+from typing import List, Iterable, Iterator
+
+CHUNK = 57  # bytes per encoded line: 76 base64 characters
+TRAILER = 0xFFFF  # length value that marks the trailer
+FRAME_HEADER = struct.Struct('>HI')  # length, CRC-32 or number of records in the trailer
+
+# ISPF banners in the data area, like '****** ***** Top of Data *****'. '*' is not in the base64 alphabet
+BANNER_RE = re.compile(r'^\s*\*{5,}.*\*{5,}\s*$')
+
+REXX_ENCODER = r"""/* REXX - dense transfer encoder for do_3270_file_io.py --dense        */
+/* Use: TSO EXEC 'your.exec.lib(DENSE)' 'input.dsn output.dsn'          */
+/* Writes every record as 2-byte length, 4-byte CRC-32 and the data,    */
+/* base64 encoded, 57 bytes per line into a new FB 80 dataset.          */
+parse upper arg indsn outdsn .
+if outdsn = '' then do
+  say 'Use: DENSE input.dsn output.dsn'
+  exit 8
+end
+alpha = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+numeric digits 12
+call crc_init
+"ALLOC F(DENSEIN) DA('"indsn"') SHR REUSE"
+if rc <> 0 then exit rc
+"ALLOC F(DENSEOUT) DA('"outdsn"') NEW CATALOG REUSE",
+  "SPACE(50,50) CYLINDERS RECFM(F B) LRECL(80) BLKSIZE(27920)"
+if rc <> 0 then exit rc
+buf = ''
+count = 0
+o = 0
+eof = 0
+do until eof
+  "EXECIO 1000 DISKR DENSEIN (STEM in."
+  if rc = 2 then eof = 1
+  else if rc <> 0 then exit rc
+  do i = 1 to in.0
+    rec = in.i
+    buf = buf || d2c(length(rec), 2) || crc32(rec) || rec
+    count = count + 1
+    do while length(buf) >= 57
+      o = o + 1
+      out.o = b64(left(buf, 57))
+      buf = substr(buf, 58)
+    end
+    if o >= 1000 then call flush
+  end
+end
+buf = buf || 'FFFF'x || d2c(count, 4)
+do while buf <> ''
+  o = o + 1
+  out.o = b64(substr(buf, 1, min(57, length(buf))))
+  buf = substr(buf, 58)
+end
+call flush
+"EXECIO 0 DISKW DENSEOUT (FINIS"
+"EXECIO 0 DISKR DENSEIN (FINIS"
+"FREE F(DENSEIN DENSEOUT)"
+say count 'records encoded into' outdsn
+exit 0
+
+flush:
+  if o > 0 then do
+    out.0 = o
+    "EXECIO" o "DISKW DENSEOUT (STEM out."
+    o = 0
+  end
+  return
+
+b64: procedure expose alpha
+  parse arg s
+  bits = x2b(c2x(s))
+  pad = ''
+  if length(s) // 3 = 1 then do
+    bits = bits || '0000'
+    pad = '=='
+  end
+  else if length(s) // 3 = 2 then do
+    bits = bits || '00'
+    pad = '='
+  end
+  r = ''
+  do i = 1 to length(bits) by 6
+    r = r || substr(alpha, x2d(b2x(substr(bits, i, 6))) + 1, 1)
+  end
+  return r || pad
+
+crc_init: procedure expose crctab.
+  do n = 0 to 255
+    c = d2c(n, 4)
+    do 8
+      b = x2b(c2x(c))
+      c = x2c(b2x('0' || left(b, 31)))
+      if right(b, 1) = '1' then c = bitxor(c, 'EDB88320'x)
+    end
+    crctab.n = c
+  end
+  return
+
+crc32: procedure expose crctab.
+  parse arg s
+  c = 'FFFFFFFF'x
+  do i = 1 to length(s)
+    n = c2d(bitxor(right(c, 1), substr(s, i, 1)))
+    c = bitxor(crctab.n, '00'x || left(c, 3))
+  end
+  return bitxor(c, 'FFFFFFFF'x)
+"""
+
+
+#####################################################################
+def encode_records(records: Iterable[bytes]) -> Iterator[str]:
+    """
+    Encodes the records exactly as the REXX encoder does. Useful for the tests and local round trips
+    :param records: raw records
+    :return: encoded lines
+    """
+    buf = bytearray()
+    count = 0
+
+    for rec in records:
+        buf += FRAME_HEADER.pack(len(rec), zlib.crc32(rec)) + rec
+        count += 1
+
+        while len(buf) >= CHUNK:
+            yield base64.b64encode(buf[:CHUNK]).decode('ascii')
+            del buf[:CHUNK]
+
+    buf += FRAME_HEADER.pack(TRAILER, count)
+    while buf:
+        yield base64.b64encode(buf[:CHUNK]).decode('ascii')
+        del buf[:CHUNK]
+
+
+#####################################################################
+class DenseDecoder:
+    """
+    Decodes the encoded lines back into records, verifying lengths and CRCs as it goes
+    """
+    def __init__(self):
+        self.records: int = 0
+        self.errors: int = 0
+        self.finished: bool = False  # the trailer was seen
+        self.__buf = bytearray()
+
+    #####################################################################
+    def feed(self, line: str) -> List[bytes]:
+        """
+        Processes one encoded line
+        :param line: line as shown on screen. Blank lines and ISPF banners are ignored
+        :return: list of the records completed by this line
+        """
+        line = line.strip()
+        if self.finished or not line or BANNER_RE.match(line):
+            return []
+
+        try:
+            self.__buf += base64.b64decode(line, validate=True)
+        except (binascii.Error, ValueError) as e:
+            print(f"!ERROR: dense decoder: bad line after record {self.records}: {e}", file=sys.stderr)
+            self.errors += 1
+            return []
+
+        out: List[bytes] = []
+        while len(self.__buf) >= FRAME_HEADER.size:
+            length, crc = FRAME_HEADER.unpack_from(self.__buf)
+
+            if length == TRAILER:
+                self.finished = True
+                if crc != self.records:
+                    print(f"!ERROR: dense decoder: {self.records} records received, {crc} sent", file=sys.stderr)
+                    self.errors += 1
+                break
+
+            if len(self.__buf) < FRAME_HEADER.size + length:
+                break  # the rest is on the next lines
+
+            rec = bytes(self.__buf[FRAME_HEADER.size:FRAME_HEADER.size + length])
+            del self.__buf[:FRAME_HEADER.size + length]
+
+            self.records += 1
+            if zlib.crc32(rec) != crc:
+                print(f"!ERROR: dense decoder: CRC mismatch in record {self.records}", file=sys.stderr)
+                self.errors += 1
+
+            out.append(rec)
+
+        return out
+
+    #####################################################################
+    def complete(self) -> bool:
+        """
+        :return: True if the whole stream was received without errors
+        """
+        return self.finished and not self.errors
+
+
+#####################################################################
+def self_test() -> bool:
+    """
+    Checks the encoder/decoder round trip on the edge cases, with the BROWSE banners around the data,
+    and that a damaged line is detected
+    :return: True if all checks passed
+    """
+    records = [b'', b'\x00', b'A' * (CHUNK - FRAME_HEADER.size), b'B' * CHUNK, bytes(range(256)) * 4,
+               os.urandom(32760)] + [os.urandom(n) for n in range(1, 200, 7)]
+    banners = ['*' * 30 + ' Top of Data ' + '*' * 30, '*' * 30 + ' Bottom of Data ' + '*' * 30]
+
+    lines = [banners[0]] + list(encode_records(records)) + [banners[1]]
+    decoder = DenseDecoder()
+    out: List[bytes] = []
+    for line in lines:
+        out += decoder.feed(line)
+
+    ok = True
+    if out != records or not decoder.complete():
+        print(f"dense_codec: round trip failed: {len(out)} of {len(records)} records, errors: {decoder.errors}",
+              file=sys.stderr)
+        ok = False
+
+    print("dense_codec: checking a damaged line, a CRC or base64 error is expected")
+    damaged = lines[:]
+    damaged[2] = damaged[2][:10] + ('A' if damaged[2][10] != 'A' else 'B') + damaged[2][11:]
+    decoder = DenseDecoder()
+    for line in damaged:
+        decoder.feed(line)
+
+    if decoder.complete():
+        print("dense_codec: a damaged line was not detected", file=sys.stderr)
+        ok = False
+
+    return ok
+
+
+#####################################################################
+if __name__ == "__main__":
+    if not self_test():
+        sys.exit(1)
+
+    print("dense_codec: round trip OK")
@@ -6,13 +6,15 @@ ISPF sessions, because of BOFHs who disable standard and easily audited means
 to celebrate security-through-obscurity centennial event.
 Written by Andrej Pakhutin (pakhutin@gmail.com)
 """
-import os.path
 import sys
 import argparse
 import re
-import time
 from x3270scripting import x3270Script
 from x3270ispf import x3270ISPF
+from record_sinks import open_sink
+from dense_codec import DenseDecoder, REXX_ENCODER
+from x3270sdsf import retrieve_jobs, SPOOL_LRECL
+from x3270pager import x3270Pager
 from typing import List, Tuple, Optional
 
 
@@ -66,8 +68,7 @@ def send_file(in_fname: str) -> None:
         print(f"Error opening input file {in_fname}: {infile_e}", file=sys.stderr)
         bail_out(1)
 
-    header = ispf.get_browse_header()
-    if header[4] != 'EDIT':
+    if ispf.current_panel()['panel'] != 'EDIT':
         print("!ERROR. Not in EDIT mode", file=sys.stderr)
         bail_out(1)
 
@@ -130,176 +131,211 @@ def receive_file(out_fname: str) -> None:
 
     file = out_fname
 
+    panel = ispf.current_panel()
+    if panel['panel'] not in ('BROWSE', 'EDIT', 'VIEW', 'HEX'):
+        print(f"Error: not in BROWSE/EDIT, but {panel['panel']} {panel.get('message', '')}", file=sys.stderr)
+        bail_out(1)
+
     if not file:
-        header = ispf.get_browse_header()
-        if header:
-            file = header[0]
+        if 'dsname' in panel:
+            file = panel['dsname']
         else:
             print("Could not determine dataset name for output file. Exiting.", file=sys.stderr)
             bail_out(1)
 
-    if os.path.exists(file):  # make sure we will not overwrite existing files
-        file += '_' + str(time.time())
-
-    try:
-        outfile = open(file, 'w')
-    except IOError as outfile_e:
-        print(f"Error opening output file {file}: {outfile_e}", file=sys.stderr)
+    # dense encoded dataset is a plain FB 80 text
+    fixed_mode = (REC_LEN <= 80 and not cmd_line.hex) or cmd_line.dense
+    decoder = DenseDecoder() if cmd_line.dense else None
+    outfile = open_sink(file, cmd_line.recfm, REC_LEN, cmd_line.compress, cmd_line.records,
+                        eol="\r\n" if fixed_mode else "\n")
+    if not outfile:
         bail_out(1)
 
-    # Apply options
-    if cmd_line.top and not ispf.command('top'):
-        return
-
-    if cmd_line.hex and not ispf.command('hex on'):
-        return
-
-    screen = term.get_screen_content()
-
-    # setting page mode if needed
-    old_page_mode = screen[3][75:79].rstrip()
-    if old_page_mode != 'PAGE':
-        term.field_fill(3, 75, "PAGE")
+    with outfile:  # closed on any exit, so a preallocated file is trimmed to the data written
+        # Apply options
+        if cmd_line.top and not ispf.command('top'):
+            return
 
-    if cmd_line.cmd_line.debug:
-        print(f". Grabbing to file: {file}")
+        if cmd_line.hex and panel['panel'] != 'HEX':
+            if not ispf.command('hex on') or not ispf.wait_for_panel('HEX'):
+                return
 
-    lines_saved = 0
-    bytes_saved = 0
+        # Scrolling with explicit amounts, so the Scroll field is not touched
+        pager = x3270Pager(ispf, cmd_line.depth)
+        pager.debug_level(cmd_line.debug)
 
-    # --- Fixed Record Length (<= 80) and not HEX mode ---
-    if REC_LEN <= 80 and not cmd_line.hex:
         if cmd_line.debug:
-            print(". Fixed/Standard Record Mode")
-
-        while True:
-            screen = term.get_screen_content()
-
-            # Data starts from row 4 (index 4) up to the second-to-last row
-            for line in screen[4:-1]:
-                if re.search(r'^\s+\*\*End\*\*\s+|\s*\*{10,} Bottom of Data \*{10,}$', line):
-                    outfile.close()
-                    print(f"+ Finished. Lines saved: {lines_saved}, bytes: {bytes_saved}")
+            print(f". Grabbing to file: {outfile.fname}")
+
+        done = False
+
+        # --- Fixed Record Length (<= 80) and not HEX mode ---
+        if fixed_mode:
+            if cmd_line.debug:
+                print(". Fixed/Standard Record Mode")
+
+            pages = pager.pages('DOWN')
+            for header, screen in pages:
+                # Data starts from the row after the command line up to the second-to-last row
+                for line in screen:
+                    if re.search(r'^\s+\*\*End\*\*\s+|\s*\*{10,} Bottom of Data \*{10,}$', line):
+                        done = True
+                        break
+
+                    if decoder:
+                        for rec in decoder.feed(line):
+                            outfile.write_record(rec)
+                    else:
+                        outfile.write_record(line)
+
+                if done:
                     break
 
-                lines_saved += 1
-                bytes_saved += len(line)
-                outfile.write(line + "\r\n")
-
-            # Page down (PF8)
-            term.script_cmd("pf 8")
-
-    # --- Variable Record Length or HEX mode ---
-    # ********************************* Top of Data *********************************
-    # ------------------------------------------------------------------------------
-    # :H3 ID=BRHEX SUBJECT=’BROWSE COMMANDS - HEX’.
-    # 7CF4CC7CDCCE4EECDCCE77CDDEEC4CDDDCDCE464CCE74
-    # A83094E2985702421533ED296625036441542000857DB
-    # ------------------------------------------------------------------------------
-    # HEX - DISPLAYING DATA IN HEXADECIMAL FORMAT
-    # CCE464CCEDDCECDC4CCEC4CD4CCECCCCCDCD4CDDDCE
-    # 8570004927318957041310950857145394130669413
-    else:
-        if cmd_line.debug:
-            print(". Variable Record Length or HEX Mode")
-
-        line_buf_size = 51
-        line_buf = [''] * line_buf_size
-
-        while True:
-            screen = term.get_screen_content()
-
-            # Check if we're scrolled right too far (empty data lines on screen)
-            empty_screen = True
-            for line_idx in range(4, len(screen) - 1):
-                if screen[line_idx].strip():  # Check for non-whitespace characters
-                    empty_screen = False
+            pages.close()  # skipping the pages requested in advance
+
+        # --- Variable Record Length or HEX mode ---
+        # ********************************* Top of Data *********************************
+        # ------------------------------------------------------------------------------
+        # :H3 ID=BRHEX SUBJECT=’BROWSE COMMANDS - HEX’.
+        # 7CF4CC7CDCCE4EECDCCE77CDDEEC4CDDDCDCE464CCE74
+        # A83094E2985702421533ED296625036441542000857DB
+        # ------------------------------------------------------------------------------
+        # HEX - DISPLAYING DATA IN HEXADECIMAL FORMAT
+        # CCE464CCEDDCECDC4CCEC4CD4CCECCCCCDCD4CDDDCE
+        # 8570004927318957041310950857145394130669413
+        else:
+            if cmd_line.debug:
+                print(". Variable Record Length or HEX Mode")
+
+            line_buf_size = 51
+            # hex mode gives us the raw bytes
+            line_buf = [bytearray() if cmd_line.hex else '' for _ in range(line_buf_size)]
+
+            # Long records are glued from the strips scrolled right, otherwise the page holds complete records
+            horizontal = REC_LEN > 80 or REC_LEN == 0
+            rows_per_record = 4 if cmd_line.hex else 1  # HEX mode scrolls by records
+            pages = None
+
+            while not done:
+                if pages is None:
+                    pages = pager.pages('RIGHT' if horizontal else 'DOWN', rows_per_record=rows_per_record)
+
+                # Fetching only the data area: from the row after the command line up to the second-to-last row
+                page = next(pages, None)
+                if page is None:
+                    print("!ERROR: cannot get the next page", file=sys.stderr)
                     break
 
-            if empty_screen:
-                if cmd_line.debug:
-                    print(". Found empty screen while scrolling right.")
-
-                # Flush the current line buffer to the file
-                for line in line_buf:
-                    if line:
-                        outfile.write(line + "\n")
+                screen = page[1]
+
+                # Check if we're scrolled right too far (empty data lines on screen)
+                empty_screen = True
+                for line_idx in range(len(screen)):
+                    if screen[line_idx].strip():  # Check for non-whitespace characters
+                        empty_screen = False
+                        break
+
+                if empty_screen:
+                    if cmd_line.debug:
+                        print(". Found empty screen while scrolling right.")
+
+                    # Flush the current line buffer to the file
+                    for line in line_buf:
+                        if line:
+                            outfile.write_record(line)
+
+                    line_buf = [bytearray() if cmd_line.hex else '' for _ in range(line_buf_size)]  # Reset buffer
+
+                    # Move back to the beginning of the line and page down
+                    pages.close()
+                    pages = None
+                    ispf.command("left max")
+                    ispf.command(f"down {max(pager.data_rows() // rows_per_record, 1)}")
+
+                    continue  # Go to next page
+
+                # Process the screen data
+                line_idx = 0
+                while line_idx < len(screen):
+                    line = screen[line_idx]
+                    line_buf_idx = line_idx
+
+                    if re.search(r'^\s+\*\*End\*\*\s+|\s*\*{10,} Bottom of Data \*{10,}$', line):
+                        # End of file detected, flush and exit
+                        for buffered_line in line_buf:
+                            if buffered_line:
+                                outfile.write_record(buffered_line)
+                        done = True
+                        break
+
+                    if cmd_line.hex:
+                        # HEX mode show 4 screen lines per record:
+                        # Line L+0: ("-" * 79)
+                        # Line L+1: Char display (we'll ignore this obviously)
+                        # Line L+2: Hex high-byte
+                        # Line L+3: Hex low-byte
+
+                        # Validate
+                        if screen[line_idx] != ("-" * 79):
+                            print("!ERROR: bad initial position for the hex mode. no dashes", file=sys.stderr)
+                            bail_out(1)
+
+                        line_idx += 2
+                        # Check bounds before accessing L+1 and L+2
+                        if line_idx + 1 >= len(screen):  # Not sure if this can ever happen really
+                            print("!ERROR: incomplete set of lines for the hex mode.", file=sys.stderr)
+                            bail_out(1)
+
+                        # Initialize the current segment for this line
+                        current_segment_bytes = bytearray()
+
+                        # now line_idx is the high nibble, line_idx+1 is the low nibble
+                        for pos in range(0, min(79, len(screen[line_idx]), len(screen[line_idx + 1]))):
+                            # Construct the two-digit hex string and convert to byte
+                            hex_char_h = screen[line_idx][pos]
+                            hex_char_l = screen[line_idx + 1][pos]
+
+                            if hex_char_h == ' ':
+                                break
+
+                            try:
+                                current_segment_bytes.append(int(hex_char_h + hex_char_l, 16))
+                            except ValueError:
+                                break
 
-                line_buf = [''] * line_buf_size  # Reset buffer
-
-                # Move back to the beginning of the line (LEFT/RIGHT 0) and page down (PF8)
-                ispf.command("right 0")  # Scroll all the way left
-                term.script_cmd("pf 8")  # Page down
+                        line_buf[line_buf_idx] += current_segment_bytes
 
-                continue  # Go to next page
+                        line_idx += 2  # Skip the two hex lines we just processed
 
-            # Process the screen data
-            line_idx = 4
-            while line_idx < len(screen) - 1:
-                line = screen[line_idx]
-                line_buf_idx = line_idx - 4
+                    else:
+                        # Variable length mode - simply concatenate the line (scrolling right)
+                        line_buf[line_buf_idx] += line
+                        line_idx += 1
 
-                if re.search(r'^\s+\*\*End\*\*\s+|\s*\*{10,} Bottom of Data \*{10,}$', line):
-                    # End of file detected, flush and exit
-                    for buffered_line in line_buf:
-                        if buffered_line:
-                            outfile.write(buffered_line + "\n")
+                if done:
                     break
 
-                if cmd_line.hex:
-                    # HEX mode show 4 screen lines per record:
-                    # Line L+0: ("-" * 79)
-                    # Line L+1: Char display (we'll ignore this obviously)
-                    # Line L+2: Hex high-byte
-                    # Line L+3: Hex low-byte
-
-                    # Validate
-                    if screen[line_idx] != ("-" * 79):
-                        print("!ERROR: bad initial position for the hex mode. no dashes", file=sys.stderr)
-                        bail_out(1)
-
-                    line_idx += 2
-                    # Check bounds before accessing L+1 and L+2
-                    if line_idx + 1 >= len(screen):  # Not sure if this can ever happen really
-                        print("!ERROR: incomplete set of lines for the hex mode.", file=sys.stderr)
-                        bail_out(1)
-
-                    # Initialize the current segment for this line
-                    current_segment_bytes = bytearray()
-
-                    # now line_idx is the high nibble, line_idx+1 is the low nibble
-                    for pos in range(0, 79):
-                        # Construct the two-digit hex string and convert to byte
-                        hex_char_h = screen[line_idx][pos]
-                        hex_char_l = screen[line_idx + 1][pos]
-
-                        if hex_char_h == ' ':
-                            break
-
-                        try:
-                            current_segment_bytes.append(int(hex_char_h + hex_char_l, 16))
-                        except ValueError:
-                            break
+                if not horizontal:  # the next page will be requested by the pager
+                    for line in line_buf:
+                        if line:
+                            outfile.write_record(line)
 
-                        line_buf[line_buf_idx] += current_segment_bytes
+                    line_buf = [bytearray() if cmd_line.hex else '' for _ in range(line_buf_size)]
 
-                        line_idx += 2  # Skip the two hex lines we just processed
+            if pages:
+                pages.close()  # skipping the pages requested in advance
 
-                else:
-                    # Variable length mode - simply concatenate the line (scrolling right)
-                    line_buf[line_buf_idx] += line
-                    line_idx += 1
+    if not done:  # the pager gave up before the end of data
+        print("!ERROR: transfer is incomplete, Bottom of Data was not reached. " +
+              f"Records saved: {outfile.records}, bytes: {outfile.bytes}", file=sys.stderr)
+        bail_out(1)
 
-            # Scroll for next segment
-            if REC_LEN > 80 or REC_LEN == 0:
-                # Scroll right (PF11) for more columns
-                term.script_cmd("pf 11")
-            else:
-                # Scroll down (PF8) for next page of data
-                term.script_cmd("pf 8")
+    print(f"+ Finished. Records saved: {outfile.records}, bytes: {outfile.bytes}")
 
-    if old_page_mode != 'PAGE':
-        term.field_fill(3, 75, old_page_mode)
+    if decoder and not decoder.complete():
+        print("!ERROR: dense transfer is incomplete or damaged. " +
+              f"Records decoded: {decoder.records}, errors: {decoder.errors}", file=sys.stderr)
+        bail_out(1)
 
 
 #####################################################################
@@ -318,17 +354,43 @@ parser.add_argument('file', nargs='?',
                     help='The name of the file to put into editor or save the data to.')
 parser.add_argument('-a', '--addr', default=ADDR, dest='addr',
                     help='Address of host to connect. Default is ' + ADDR)
+parser.add_argument('--dense', action='store_true', default=False, dest='dense',
+                    help='Receive a binary dataset encoded on the host by the exec from --gen-rexx. ' +
+                    'BROWSE the encoded dataset, the decoded and verified records are saved. ' +
+                    'Use with --recfm V or F to keep the record boundaries')
+parser.add_argument('--gen-rexx', default='', dest='gen_rexx', metavar='FILE',
+                    help='Save the dense encoder REXX exec to the FILE, to be uploaded to the host')
+parser.add_argument('--depth', type=int, default=4, dest='depth',
+                    help='Max number of pages requested in advance while paging. 1 disables the prefetch. Default: 4')
 parser.add_argument('-d', '--debug', type=int, default=0, dest='debug', help='debug level')
+parser.add_argument('--compress', choices=['gzip', 'zstd'], default='', dest='compress',
+                    help='Compress the received file. zstd requires the zstandard package')
 parser.add_argument('--hex', action='store_true', default=False, dest='hex',
                     help='Grab hexadecimal values (turns on hex mode in ISPF)')
+parser.add_argument('--job', action='append', default=[], dest='jobs', metavar='JOBNAME[:JOBID]',
+                    help='Retrieve the job output from SDSF into per-DD files. The file argument is the output ' +
+                    'directory then. Can be repeated')
 parser.add_argument('-p', '--port', type=int, default=PORT, dest='port',
                     help='Port to connect to. Default is ' + str(PORT))
-parser.add_argument('--rec-len', type=int, default=REC_LEN, dest='reclen', help='Record length. Default: 80')
+parser.add_argument('--rec-len', type=int, default=REC_LEN, dest='reclen',
+                    help='Record length. Default: 80. ' +
+                    f'With --job, values above 80 set the spool lines width, {SPOOL_LRECL} by default')
+parser.add_argument('--recfm', choices=['text', 'F', 'V'], default='text', dest='recfm',
+                    help='Received file format: text lines, fixed length records (RECFM=F) ' +
+                    'or variable length records with RDWs (RECFM=V). Default: text')
+parser.add_argument('--records', type=int, default=0, dest='records',
+                    help='Number of records from ISPF statistics, if known. Preallocates the output file')
 parser.add_argument('-r', '--receive', action='store_true', dest='receive',
                     help='Receive file mode. Grabs content from EDIT/BROWSE.\n' +
                     'NOTE: The save file name is optional. It will be derived from the original name in browser')
+parser.add_argument('--session', action='append', default=[], dest='sessions', metavar='HOST:PORT',
+                    help='Additional logged on terminal to retrieve the jobs in parallel. Can be repeated')
 parser.add_argument('-s', '--send', action='store_true', dest='send',
                     help='Send file mode. Fills in content in ISPF EDIT')
+parser.add_argument('-t', '--timeout', type=float, default=30, dest='timeout',
+                    help='Seconds to wait for the terminal to complete a command. Default: 30')
+parser.add_argument('--tail', action='store_true', default=False, dest='tail',
+                    help='Keep polling the last DD of active jobs for the new lines')
 parser.add_argument('--top', action='store_true', default=False, dest='top',
                     help='Reposition to the top of the file before grabbing')
 
@@ -339,6 +401,33 @@ ADDR = cmd_line.addr
 PORT = cmd_line.port
 REC_LEN = cmd_line.reclen
 
+if cmd_line.gen_rexx:
+    try:
+        with open(cmd_line.gen_rexx, 'w') as rexx_file:
+            rexx_file.write(REXX_ENCODER)
+    except IOError as rexx_e:
+        print(f"Error writing {cmd_line.gen_rexx}: {rexx_e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"+ Dense encoder exec saved to {cmd_line.gen_rexx}")
+    sys.exit(0)
+
+if cmd_line.dense and cmd_line.hex:
+    print("You can use either --dense or --hex")
+    sys.exit(1)
+
+if cmd_line.jobs:
+    sessions = [(ADDR, PORT)]
+    for sess in cmd_line.sessions:
+        s_addr, _, s_port = sess.rpartition(':')
+        sessions.append((s_addr or ADDR, int(s_port)))
+
+    jobs = [(j.partition(':')[0], j.partition(':')[2]) for j in cmd_line.jobs]
+    saved = retrieve_jobs(sessions, jobs, cmd_line.file or '.', cmd_line.tail, cmd_line.debug,
+                          cmd_line.timeout, 3, REC_LEN if REC_LEN > 80 else SPOOL_LRECL)
+    print(f"+ Finished. Files saved: {len(saved)}, lines: {sum(saved.values())}")
+    sys.exit(0)
+
 if cmd_line.send and cmd_line.receive:
     print("You can only send or receive file")
     sys.exit(1)
@@ -349,11 +438,13 @@ if not cmd_line.send and not cmd_line.receive:
 
 # --- Socket Setup ---
 term = x3270Script(ADDR, PORT)
+term.debug_level(cmd_line.debug)
+term.set_timeout(cmd_line.timeout)
+term.set_reconnect(3)
+
 if not term.connected():
     sys.exit(1)
 
-term.debug_level(cmd_line.debug)
-
 ispf = x3270ISPF(term)
 ispf.debug_level(cmd_line.debug)
 
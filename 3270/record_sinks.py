@@ -0,0 +1,232 @@
+"""
+This module is a part of z/OS toolset interacting with 3270 terminal emulator
+by https://x3270.bgp.nu/ team.
+    The function is to save the received dataset records to local files, keeping the record
+boundaries when needed: as text lines, fixed length records (RECFM=F) or variable length
+records with 4-byte RDWs (RECFM=V), optionally gzip or zstd compressed.
+zstd requires the 'zstandard' package.
+Written by Andrej Pakhutin (pakhutin@gmail.com)
+"""
+import os
+import sys
+import gzip
+import mmap
+import struct
+import time
+from typing import Union, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Writes are gathered into this large chunks before hitting the disk or compressor
+BUFFER_SIZE = 4 * 1024 * 1024
+
+# max data length for RECFM=V. The RDW length includes RDW itself
+MAX_VREC_LEN = 32756
+
+
+#####################################################################
+class RecordSink:
+    """
+    Base class for the record writers. Subclasses define _frame() to turn a record into bytes.
+    """
+    def __init__(self, fname: str, compress: str = '', size_hint: int = 0, encoding: str = 'latin-1'):
+        """
+        :param fname: output file name
+        :param compress: '', 'gzip' or 'zstd'
+        :param size_hint: expected output size in bytes, e.g. from ISPF statistics. If given and not compressing,
+            the file is preallocated and written via memory mapping
+        :param encoding: used to convert str records to bytes
+        """
+        self.fname = fname
+        self.records: int = 0
+        self.bytes: int = 0  # payload, without framing
+        self.__encoding = encoding
+        self.__buf = bytearray()
+        self.__file = None
+        self.__out = None
+        self.__mm: Optional[mmap.mmap] = None
+        self.__pos: int = 0
+
+        if compress == 'gzip':
+            self.__out = gzip.open(fname, 'wb', compresslevel=6)
+
+        elif compress == 'zstd':
+            if zstandard is None:
+                raise ValueError("zstd compression requires the 'zstandard' package")
+            self.__file = open(fname, 'wb')
+            self.__out = zstandard.ZstdCompressor().stream_writer(self.__file)
+
+        elif compress:
+            raise ValueError(f"Unknown compression: {compress}")
+
+        elif size_hint > 0:
+            self.__file = open(fname, 'w+b')
+            self.__file.truncate(size_hint)
+            self.__mm = mmap.mmap(self.__file.fileno(), size_hint)
+
+        else:
+            self.__out = open(fname, 'wb')
+
+    #####################################################################
+    def _frame(self, data: bytes) -> bytes:
+        """
+        Turns a record into the output bytes
+        """
+        raise NotImplementedError
+
+    #####################################################################
+    def write_record(self, rec: Union[str, bytes, bytearray]) -> None:
+        """
+        Writes one record
+        :param rec: record data. str is encoded first
+        """
+        data = rec.encode(self.__encoding, errors='replace') if isinstance(rec, str) else bytes(rec)
+
+        self.records += 1
+        self.bytes += len(data)
+
+        if self.__mm is not None:
+            self.__mm_write(self._frame(data))
+            return
+
+        self.__buf += self._frame(data)
+        if len(self.__buf) >= BUFFER_SIZE:
+            self.__out.write(self.__buf)
+            self.__buf.clear()
+
+    #####################################################################
+    def __mm_write(self, data: bytes) -> None:
+        end = self.__pos + len(data)
+        if end > len(self.__mm):  # the hint was too small
+            self.__mm.resize(max(end, len(self.__mm) * 2))
+
+        self.__mm[self.__pos:end] = data
+        self.__pos = end
+
+    #####################################################################
+    def close(self) -> None:
+        """
+        Flushes everything and closes the file
+        """
+        if self.__mm is not None:
+            self.__mm.flush()
+            self.__mm.close()
+            self.__mm = None
+            self.__file.truncate(self.__pos)  # trimming the unused preallocated space
+
+        if self.__out is not None:
+            if self.__buf:
+                self.__out.write(self.__buf)
+                self.__buf.clear()
+            self.__out.close()
+            self.__out = None
+
+        if self.__file is not None:
+            if not self.__file.closed:
+                self.__file.close()
+            self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+#####################################################################
+class TextSink(RecordSink):
+    """
+    Records as text lines
+    """
+    def __init__(self, fname: str, eol: str = '\n', **kwargs):
+        self.__eol = eol.encode('ascii')
+        super().__init__(fname, **kwargs)
+
+    def _frame(self, data: bytes) -> bytes:
+        return data + self.__eol
+
+
+#####################################################################
+class FixedSink(RecordSink):
+    """
+    RECFM=F: each record is padded or truncated to LRECL, no separators
+    """
+    def __init__(self, fname: str, lrecl: int, pad: bytes = b' ', **kwargs):
+        self.__lrecl = lrecl
+        self.__pad = pad
+        self.truncated: int = 0  # number of records longer than LRECL
+        super().__init__(fname, **kwargs)
+
+    def _frame(self, data: bytes) -> bytes:
+        if len(data) > self.__lrecl:
+            self.truncated += 1
+            return data[:self.__lrecl]
+
+        return data.ljust(self.__lrecl, self.__pad)
+
+
+#####################################################################
+class VariableSink(RecordSink):
+    """
+    RECFM=V: each record is prefixed with 4-byte RDW: 2 bytes big-endian length including RDW, 2 zero bytes
+    """
+    def __init__(self, fname: str, **kwargs):
+        self.truncated: int = 0  # number of records longer than allowed
+        super().__init__(fname, **kwargs)
+
+    def _frame(self, data: bytes) -> bytes:
+        if len(data) > MAX_VREC_LEN:
+            self.truncated += 1
+            data = data[:MAX_VREC_LEN]
+
+        return struct.pack('>HH', len(data) + 4, 0) + data
+
+
+#####################################################################
+def open_sink(fname: str, recfm: str = 'text', lrecl: int = 80, compress: str = '', records: int = 0,
+              eol: str = '\n') -> Optional[RecordSink]:
+    """
+    Creates the sink of the requested format.
+    :param fname: output file name. '.gz' or '.zst' is appended when compressing.
+        An existing file is never overwritten, a timestamp is added to the name instead
+    :param recfm: 'text', 'F' or 'V'
+    :param lrecl: record length
+    :param compress: '', 'gzip' or 'zstd'
+    :param records: expected number of records, e.g. from ISPF statistics. Used to preallocate the output
+    :param eol: line end for the text format
+    :return: sink or None on error
+    """
+    ext = {'gzip': '.gz', 'zstd': '.zst'}.get(compress, '')
+    if ext and fname.endswith(ext):
+        fname = fname[:-len(ext)]
+
+    if os.path.exists(fname + ext):  # make sure we will not overwrite existing files
+        fname += '_' + str(time.time())
+
+    fname += ext
+
+    size_hint = 0
+    if records > 0 and not compress:
+        size_hint = records * {'F': lrecl, 'V': lrecl + 4}.get(recfm, lrecl + len(eol))
+
+    try:
+        if recfm == 'F':
+            return FixedSink(fname, lrecl, compress=compress, size_hint=size_hint)
+
+        if recfm == 'V':
+            return VariableSink(fname, compress=compress, size_hint=size_hint)
+
+        return TextSink(fname, eol, compress=compress, size_hint=size_hint)
+
+    except (IOError, ValueError) as e:
+        print(f"Error opening output file {fname}: {e}", file=sys.stderr)
+        return None
+
+
+#####################################################################
+if __name__ == "__main__":
+    print("record_sinks: This module should only be imported")
+    sys.exit(1)
@@ -9,14 +9,159 @@ Written by Andrej Pakhutin (pakhutin@gmail.com)
 
 import re
 import sys
-from typing import List, Tuple, Optional
+import time
+from typing import List, Tuple, Optional, Dict, Union
 from x3270scripting import x3270Script
 
+# Example: ' BROWSE BISR.WFADO.R98.DBMACS(VGGDWR12)      Line 0000000000 Col 001 080 '
+#          ' EDIT  ZUSER.PROGRAM.CNTL(SORTCNTL) - 01.00  Columns 00001 00072'
+BROWSE_HEADER_RE = re.compile(r'^\s*(?P<mode>BROWSE|EDIT\S*|VIEW)\s+(?P<dsname>\S+)(?:\s+-\s+[\d.]+)?\s+'
+                              r'(?:(?:Row|Line)\s+(?P<line>\d+)\s+)?Col(?:umns)?\s+(?P<col>\d+)\s+(?P<col_to>\d+)',
+                              re.IGNORECASE)
 
+# Short message in place of Line/Col, like 'Bottom of data reached'
+BROWSE_MESSAGE_RE = re.compile(r'^\s*(?P<mode>BROWSE|EDIT\S*|VIEW)\s+(?P<dsname>\S+\.\S+)\s+(?P<message>.+?)\s*$',
+                               re.IGNORECASE)
+
+COMMAND_LABEL = r'(?:Command|COMMAND INPUT|Option) ===>'
+COMMAND_LINE_RE = re.compile(r'(?P<label>' + COMMAND_LABEL + r')'
+                             r'(?:.*?Scroll ===>\s*(?P<scroll>\S*))?', re.IGNORECASE)
+
+# Panel signatures, checked in this order against the rows above the command line.
+# Named groups become the panel fields.
+PANEL_SIGNATURES = [
+    ('SDSF_OUTPUT', re.compile(r'^\s*SDSF OUTPUT DISPLAY\s+(?P<jobname>\S+)\s+(?P<jobid>\S+)\s+DSID\s+(?P<dsid>\d+)'
+                               r'\s+LINE\s+(?P<line>\d+)\s+COLUMNS\s+(?P<col>\d+)-\s*(?P<col_to>\d+)', re.IGNORECASE)),
+    ('SDSF', re.compile(r'^\s*SDSF\s+(?P<title>.+?)\s+(?:LINE|ROW)\s+(?P<line>\d+)', re.IGNORECASE)),
+    ('DSLIST', re.compile(r'^\s*DSLIST\s+-\s+Data Sets Matching\s+(?P<dsname>\S+)'
+                          r'\s+Row\s+(?P<line>\d+)\s+of\s+(?P<total>\d+)', re.IGNORECASE)),
+    ('MEMLIST', re.compile(r'^\s*(?P<mode>BROWSE|EDIT|VIEW)\s+(?P<dsname>\S+)'
+                           r'\s+Row\s+(?P<line>\d+)\s+of\s+(?P<total>\d+)\s*$', re.IGNORECASE)),
+    ('BROWSE', BROWSE_HEADER_RE),
+    ('BROWSE', BROWSE_MESSAGE_RE),
+]
+
+# Long message popup. ISPF draws it right below the command line:
+#  +----------------------------------------------+
+#  | Data set not cataloged                       |
+#  +----------------------------------------------+
+POPUP_BORDER_RE = re.compile(r'^(?P<indent>\s*)[+.\']-{10,}[+.\']\s*$')
+POPUP_MESSAGE_RE = re.compile(r'^\s*\|\s*(?P<message>\S.*?)\s*\|\s*$')
+POPUP_ROWS = 3  # max rows between the command line and the popup top border
+
+# TSO line mode messages, only when there is no ISPF command line at all
+TSO_MESSAGE_RE = re.compile(r'^\s*(?P<msgid>IKJ\d{5}[A-Z])\s+(?P<text>.+)$')
+
+# HEX display of BROWSE/EDIT: every record is the characters row, zone and numeric hex rows, and a dash separator
+HEX_DIGITS_RE = re.compile(r'^\s*[0-9A-F]+\s*$')
+HEX_SEPARATOR_RE = re.compile(r'^\s*-{10,}\s*$')
+
+PANEL_INT_FIELDS = ('line', 'col', 'col_to', 'total', 'dsid')
+
+
+#####################################################################
+def _popup_message(screen: List[str], cmd_row: int) -> Optional[str]:
+    """
+    Looks for the long message popup right below the command line.
+    Both borders must be there and line up with the message box, so the data rows do not count.
+    :return: message text or None
+    """
+    for top in range(cmd_row + 1, min(cmd_row + 1 + POPUP_ROWS, len(screen))):
+        if not (border := POPUP_BORDER_RE.match(screen[top])):
+            continue
+
+        left = len(border.group('indent'))
+        right = len(screen[top].rstrip()) - 1
+        lines = []
+        for line in screen[top + 1:]:
+            if POPUP_BORDER_RE.match(line) and len(line.rstrip()) - 1 == right:
+                return ' '.join(lines) if lines else None
+
+            m = POPUP_MESSAGE_RE.match(line)
+            if not m or line.index('|') != left or len(line.rstrip()) - 1 != right:
+                break
+
+            lines.append(m.group('message'))
+
+    return None
+
+
+#####################################################################
+def _is_hex_display(screen: List[str], data_row: int) -> bool:
+    """
+    Checks for the HEX layout in the data area: a dash separator after two rows of hex digits
+    """
+    for y in range(data_row + 2, len(screen)):
+        if (HEX_SEPARATOR_RE.match(screen[y]) and HEX_DIGITS_RE.match(screen[y - 1])
+                and HEX_DIGITS_RE.match(screen[y - 2])
+                and len(screen[y - 1].strip()) == len(screen[y - 2].strip())):
+            return True
+
+    return False
+
+
+#####################################################################
+def recognize_panel(screen: List[str]) -> Dict[str, Union[str, int]]:
+    """
+    Classifies the screen in one pass over a single snapshot and extracts all known panel fields.
+    :param screen: screen content as returned by get_screen_content
+    :return: dict with at least 'panel': BROWSE|EDIT|VIEW|HEX|DSLIST|MEMLIST|SDSF|SDSF_OUTPUT|ERROR|UNKNOWN
+        and 'cmd_row', 'cmd_col', 'data_row' (-1 if no command line). Other keys depend on the panel:
+        'mode', 'dsname', 'line', 'col', 'col_to', 'total', 'scroll', 'message', 'jobname', 'jobid', 'dsid', 'title'
+    """
+    panel: Dict[str, Union[str, int]] = {'panel': 'UNKNOWN', 'cmd_row': -1, 'cmd_col': -1, 'data_row': -1}
+
+    # The command line and panel header only. The data rows are never checked for signatures
+    header_done = False
+    for y, line in enumerate(screen):
+        if panel['cmd_row'] == -1:
+            if m := COMMAND_LINE_RE.search(line):
+                panel['cmd_row'] = y
+                panel['cmd_col'] = m.end('label') + 1  # skipping the attribute byte
+                panel['data_row'] = y + 1
+                if m.group('scroll') is not None:
+                    panel['scroll'] = m.group('scroll')
+                    panel['scroll_col'] = m.start('scroll')
+
+        if not header_done and (panel['cmd_row'] == -1 or y <= panel['cmd_row']):
+            for name, sig in PANEL_SIGNATURES:
+                if m := sig.match(line):
+                    panel['panel'] = name
+                    panel['header_row'] = y
+                    for k, v in m.groupdict().items():
+                        if v is not None:
+                            panel[k] = int(v) if k in PANEL_INT_FIELDS else v
+                    header_done = True
+                    break
+
+    if panel['cmd_row'] == -1:
+        for line in screen:
+            if m := TSO_MESSAGE_RE.match(line):
+                panel['panel'] = 'ERROR'
+                panel['message'] = m.group('msgid') + ' ' + m.group('text')
+                break
+
+    elif message := _popup_message(screen, int(panel['cmd_row'])):
+        panel['panel'] = 'ERROR'
+        panel['message'] = message
+
+    elif panel['panel'] == 'BROWSE' and _is_hex_display(screen, int(panel['data_row'])):
+        panel['panel'] = 'HEX'
+
+    # BROWSE signatures are shared by all the editor-like panels
+    if panel['panel'] == 'BROWSE':
+        mode = str(panel['mode']).upper()
+        panel['panel'] = 'EDIT' if mode.startswith('EDIT') else mode
+
+    return panel
+
+
+#####################################################################
 class x3270ISPF:
     def __init__(self, atermscript: x3270Script):
         self.__termscript: x3270Script = atermscript
         self.__debug: int = 0
+        self.__panel: Dict[str, Union[str, int]] = {'panel': 'UNKNOWN'}
 
     def debug_level(self, level: int) -> None:
         if level < 0:
@@ -35,20 +180,80 @@ class x3270ISPF:
         3: right (max?) columns
         4: mode: BROWSE|EDIT
         """
-        screen = self.__termscript.get_screen_content()
-        if len(screen) < 3:
+        screen = self.__termscript.get_screen_rows(2)  # the header row only
+        if not screen:
             return None
 
         # TODO: determine what is the 2nd number after 'Col'
-        # Example: ' BROWSE BISR.WFADO.R98.DBMACS(VGGDWR12)      Line 0000000000 Col 001 080 '
-        match = re.match(r'\s*(BROWSE|EDIT\S*)\s+(\S+)\s+(Row|Line)\s+(\d+)\s+Col\s+(\d+)\s+(\d+)',
-                         screen[2], re.IGNORECASE)
+        # EDIT has no line number in the header. 0 is returned then
+        match = BROWSE_HEADER_RE.match(screen[0])
         if match:
-            return match.group(2), int(match.group(4)), int(match.group(5)), int(match.group(6)), match.group(1)
+            return (match.group('dsname'), int(match.group('line') or 0), int(match.group('col')),
+                    int(match.group('col_to')), match.group('mode'))
 
         print("Error: probably not in BROWSE/EDIT", file=sys.stderr)
         return None
 
+    #####################################################################
+    def termscript(self) -> x3270Script:
+        """
+        Returns the underlying terminal, for the modules built on top of this one
+        """
+        return self.__termscript
+
+    #####################################################################
+    def current_panel(self, screen: Optional[List[str]] = None) -> Dict[str, Union[str, int]]:
+        """
+        Recognizes the current panel from a single snapshot. See recognize_panel() for the fields.
+        The snapshot also becomes the baseline of the terminal's wait_for_change()
+        :param screen: already fetched full screen content. Will be fetched if None
+        :return: panel fields dict. Also remembered as the last known panel
+        """
+        if screen is None:
+            screen = self.__termscript.get_screen_content()
+
+        self.__termscript.screen_diff(screen)
+        self.__panel = recognize_panel(screen)
+
+        if self.__debug > 1:
+            print(f". ISPF panel: {self.__panel['panel']}")
+
+        return self.__panel
+
+    #####################################################################
+    def last_panel(self) -> Dict[str, Union[str, int]]:
+        """
+        Returns the last recognized panel without talking to the terminal.
+        """
+        return self.__panel
+
+    #####################################################################
+    def wait_for_panel(self, *names: str, timeout: float = 10) -> Optional[Dict[str, Union[str, int]]]:
+        """
+        Waits until the screen becomes one of the given panels. The screen is re-read only
+        when the host changes it.
+        :param names: expected panel names, like 'BROWSE', 'HEX'
+        :param timeout: seconds to wait
+        :return: panel fields dict or None on timeout or ERROR panel
+        """
+        deadline = time.monotonic() + timeout
+
+        panel = self.current_panel()
+        while panel['panel'] not in names:
+            if panel['panel'] == 'ERROR':
+                print(f"ISPF error: {panel.get('message', '')}", file=sys.stderr)
+                return None
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.__termscript.wait_for_change(timeout=remaining):
+                print(f"ispf.wait_for_panel(): timed out waiting for {names}, got {panel['panel']}",
+                      file=sys.stderr)
+                return None
+
+            panel = self.current_panel(self.__termscript.last_screen())
+
+        return panel
+
     #####################################################################
     def get_row_number(self) -> int:
         """
@@ -68,21 +273,13 @@ class x3270ISPF:
         """
         Issues a command on the Command ===> line.
         """
-        r, c = self.__termscript.find_text(r'Command ===>')
-
-        if r == -1:
-            print("ispf.command(): Looks like we're not in ISPF here?", file=sys.stderr)
-            return False
-
         #    2            15                <- 48 ->                      63           75
         #    |            |                                               |            |
         # .  Command ===>                                                  Scroll ===> CSR   .
-        # Pad the command with spaces to the end of the input field
-
-        self.__termscript.script_cmd(f"MoveCursor({r},15)")
-        command_str = command + (' ' * (48 - len(command)))
-
-        self.__termscript.script_cmd(f'String "{command_str}\\n"')
+        # The rest of the input field is erased, then Enter pressed in the same batch
+        if self.__termscript.fill_form({COMMAND_LABEL: command}) is None:
+            print("ispf.command(): Looks like we're not in ISPF here?", file=sys.stderr)
+            return False
 
         # TODO: need to detect syntax errors - yellow top right corner (requires checking screen attributes/colors?)
         return True
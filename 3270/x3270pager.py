@@ -0,0 +1,186 @@
+"""
+    This module is a part of z/OS toolset interacting with 3270 terminal emulator
+by https://x3270.bgp.nu/ team. You need to enable scripting port for it to work.
+    The function is to page through BROWSE/EDIT-like panels as fast as the host allows:
+explicit DOWN n/RIGHT n commands sized to the data area, so the Scroll field does not matter,
+and the next page requests are sent before the current page is processed.
+The number of pages in flight is raised only while it keeps cutting the measured wait per page.
+This module depends on x3270ISPF and x3270Script modules of the same author.
+Written by Andrej Pakhutin (pakhutin@gmail.com)
+"""
+
+import sys
+import time
+from collections import deque
+from typing import List, Tuple, Iterator, Deque
+from x3270scripting import x3270Script, clean_screen_line
+from x3270ispf import x3270ISPF
+
+PROBE_PAGES = 3  # pages measured at every depth
+PROBE_GAIN = 0.9  # a deeper pipeline is kept only if it cuts the wait per page below this share
+PROBE_DRIFT = 1.5  # the host got that much slower or faster: probing again
+PROBE_NOISE = 0.001  # seconds. Smaller changes of the wait per page are not counted
+
+
+class x3270Pager:
+    def __init__(self, aispf: x3270ISPF, max_depth: int = 4):
+        """
+        :param aispf: ISPF session to work in
+        :param max_depth: max number of page requests in flight. 1 disables the prefetch.
+            The depth starts at 1 and is raised up to this while it keeps cutting the wait per page
+        """
+        self.__ispf: x3270ISPF = aispf
+        self.__termscript: x3270Script = aispf.termscript()
+        self.__max_depth = max(max_depth, 1)
+        self.__depth: int = 1
+        self.__samples: List[float] = []  # how long we waited for the host on every page, seconds
+        self.__best: float = 0.0  # average wait per page at the kept depth
+        self.__samples_taken: bool = False  # the first PROBE_PAGES pages were measured, __best is valid
+        self.__settled: bool = False  # the deeper pipeline did not pay off, staying at this depth
+        self.__drifted: int = 0  # windows in a row with the wait away from __best
+        self.__data_rows: int = 0
+        self.__data_cols: int = 0
+        self.__debug: int = 0
+
+    def debug_level(self, level: int) -> None:
+        if level < 0:
+            self.__debug = 0
+        elif level > 9:
+            self.__debug = 9
+        else:
+            self.__debug = level
+
+    #####################################################################
+    def data_rows(self) -> int:
+        """
+        Returns the number of data rows on the page, as found by the last pages() call
+        """
+        return self.__data_rows
+
+    #####################################################################
+    def data_cols(self) -> int:
+        """
+        Returns the number of data columns on the page, as found by the last pages() call
+        """
+        return self.__data_cols
+
+    #####################################################################
+    def __tune(self, wait: float) -> None:
+        """
+        Adjusts the number of requests in flight from the host wait per page, averaged over PROBE_PAGES pages.
+        The depth goes up one step at a time while every step cuts the wait. The first step that does not
+        is taken back and the depth stays, until the host speed drifts away for two windows in a row.
+        Then the current depth is measured again and probing restarts from it.
+        :param wait: seconds spent waiting for the last page
+        """
+        self.__samples.append(wait)
+        if len(self.__samples) < PROBE_PAGES:
+            return
+
+        avg = sum(self.__samples) / len(self.__samples)
+        self.__samples.clear()
+        depth = self.__depth
+
+        if self.__settled:
+            if (self.__best / PROBE_DRIFT <= avg <= self.__best * PROBE_DRIFT
+                    or abs(avg - self.__best) < PROBE_NOISE):
+                self.__drifted = 0
+                return
+
+            self.__drifted += 1
+            if self.__drifted < 2:  # a single slow or fast window is just noise
+                return
+
+            self.__drifted = 0
+            self.__settled = False  # starting over: measuring this depth again first
+            self.__samples_taken = False
+            return
+        elif not self.__samples_taken or avg < min(self.__best * PROBE_GAIN, self.__best - PROBE_NOISE):
+            self.__samples_taken = True
+            self.__best = avg
+        else:
+            self.__depth -= 1
+            self.__settled = True
+
+        if not self.__settled:
+            if self.__depth < self.__max_depth:
+                self.__depth += 1
+            else:
+                self.__settled = True
+
+        if self.__debug > 1 and self.__depth != depth:
+            print(f". pager: depth {self.__depth}, wait per page {avg:.3f}s")
+
+    #####################################################################
+    def pages(self, direction: str = 'DOWN', amount: int = 0,
+              rows_per_record: int = 1) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Generates the pages, starting from the current one.
+        Scrolling past the end is harmless for BROWSE, so the pages after the end of data
+        may be requested already when the caller stops. Their replies are skipped.
+        :param direction: DOWN, UP, RIGHT or LEFT
+        :param amount: scroll amount. Default is the full data area: records for DOWN/UP, columns for RIGHT/LEFT
+        :param rows_per_record: screen rows every record takes, like 4 in HEX mode.
+            The page is then cut to the records that are fully on it, the scroll amount being that many records
+        :return: iterator of (header row, data rows) tuples. The last screen row is not included
+        """
+        panel = self.__ispf.current_panel()
+        if int(panel['cmd_row']) == -1:
+            print("pager: Looks like we're not in ISPF here?", file=sys.stderr)
+            return
+
+        rows, cols = self.__termscript.get_screen_size()
+        if rows == -1:
+            return
+
+        top = int(panel.get('header_row', panel['cmd_row']))
+        data_offset = int(panel['data_row']) - top
+        self.__data_rows = rows - int(panel['data_row']) - 1
+        self.__data_cols = int(panel['col_to']) - int(panel['col']) + 1 if 'col_to' in panel else cols
+
+        records = max(self.__data_rows // rows_per_record, 1)
+        if amount <= 0:
+            amount = self.__data_cols if direction.upper() in ('RIGHT', 'LEFT') else records
+
+        # the rows of the records not fully on the page are left for the next one
+        data_end = data_offset + records * rows_per_record if rows_per_record > 1 else None
+
+        timeout = self.__termscript.get_timeout()
+        read_cmd = f"Ascii({top},0,{rows - top - 1},{cols})"
+        # Waiting for unlock right here, so the read after it will see the new page.
+        # The terminal-side timeout keeps us in sync: it replies with error instead of staying silent
+        scroll_cmd = (f"MoveCursor({panel['cmd_row']},{panel['cmd_col']}) EraseEOF "
+                      f'String("{direction} {amount}") Enter Wait({max(int(timeout), 1)},Unlock)')
+
+        inflight: Deque[int] = deque()  # number of replies for every page requested: read only or scroll + read
+        self.__termscript.send_line(read_cmd)
+        inflight.append(1)
+
+        try:
+            while True:
+                while len(inflight) < self.__depth:
+                    self.__termscript.send_line(scroll_cmd)
+                    self.__termscript.send_line(read_cmd)
+                    inflight.append(2)
+
+                started = time.monotonic()
+                if inflight.popleft() == 2:
+                    a = self.__termscript.read_answer(timeout + 1)
+                    if not a or a[-1] != 'ok':
+                        print(f"pager: {direction} {amount} failed", file=sys.stderr)
+                        inflight.appendleft(1)  # the read is still on the way
+                        return
+
+                a = self.__termscript.read_answer()
+                if not a or a[-1] != 'ok':
+                    print("pager: cannot read the page", file=sys.stderr)
+                    return
+
+                self.__tune(time.monotonic() - started)
+
+                screen = [clean_screen_line(line) for line in a[:-1]]
+                yield (screen[0] if screen else ''), screen[data_offset:data_end]
+
+        finally:
+            if inflight:
+                self.__termscript.discard_replies(sum(inflight))
@@ -5,8 +5,16 @@ Written by Andrej Pakhutin (pakhutin@gmail.com)
 """
 import sys
 import socket
+import selectors
 import re
-from typing import List, Tuple, Optional
+import time
+from typing import List, Tuple, Optional, Dict, Union
+
+# Reply status of a command that did not complete within its deadline. Others are 'ok' and 'error'
+TIMEOUT = 'timeout'
+
+# Default per-command deadline, seconds
+DEFAULT_TIMEOUT = 30
 
 # EBCDIC to ASCII. This is very simple approximation, mostly for the \w stuff to work
 E2A = [
@@ -43,6 +51,122 @@ def e2a(e: str) -> str:
     return a
 
 
+# The encasing dots and spaces of the 3270 script screen output
+SCREEN_BORDER_RE = re.compile(r'^\s*\.+\s(.+?)\s*\.+\s*$')
+
+
+def clean_screen_line(line: str) -> str:
+    """
+    Strips the encasing dots and spaces from a single line of the 3270 screen output
+    :param line: raw line
+    :return: cleaned line. Lines without the border are just right-stripped
+    """
+    match = SCREEN_BORDER_RE.match(line)
+    if match:
+        return match.group(1).rstrip()
+
+    # Fallback: keep the line
+    return line.rstrip()
+
+
+# Compiled multi-pattern searches, keyed by the tuple of patterns
+_PATTERN_CACHE: Dict[Tuple[str, ...], List[re.Pattern]] = {}
+_PATTERN_CACHE_SIZE = 256
+
+
+def compile_patterns(patterns: Tuple[str, ...]) -> List[re.Pattern]:
+    """
+    Compiles several regexps one by one. Results are cached
+    :param patterns: regexps
+    :return: list of the compiled patterns
+    """
+    compiled = _PATTERN_CACHE.get(patterns)
+    if compiled is None:
+        if len(_PATTERN_CACHE) >= _PATTERN_CACHE_SIZE:
+            _PATTERN_CACHE.clear()
+
+        # not joined into one alternation: inline flags, group names and backreferences must stay per pattern
+        compiled = [re.compile(p) for p in patterns]
+        _PATTERN_CACHE[patterns] = compiled
+
+    return compiled
+
+
+#####################################################################
+def search_screen(screen: List[str], patterns: List[str]) -> List[Tuple[int, int, int, int]]:
+    """
+    Searches for all of the patterns over the screen.
+    Each pattern reports all of its own non-overlapping matches, like re.finditer does.
+    Matches of different patterns may overlap or sit inside each other
+    :param screen: screen content as returned by get_screen_content
+    :param patterns: regexps
+    :return: list of (pattern index, row, start col, end col) sorted by row, start col and pattern index.
+        End col is exclusive
+    """
+    each_rx = compile_patterns(tuple(patterns))
+    found: List[Tuple[int, int, int, int]] = []
+
+    for y, line in enumerate(screen):
+        row: List[Tuple[int, int, int, int]] = []
+        for i, rx in enumerate(each_rx):
+            row.extend((i, y, m.start(), m.end()) for m in rx.finditer(line))
+
+        row.sort(key=lambda f: (f[2], f[0]))
+        found.extend(row)
+
+    return found
+
+
+#####################################################################
+def diff_screens(old: List[str], new: List[str],
+                 region: Optional[Tuple[int, int, int, int]] = None) -> List[Tuple[int, int, int]]:
+    """
+    Compares two screen snapshots (as returned by get_screen_content)
+    :param old: previous snapshot
+    :param new: current snapshot
+    :param region: optional (row, col, rows, cols) rectangle to limit the comparison to
+    :return: list of (row, start col, end col) spans that differ. End col is exclusive
+    """
+    spans: List[Tuple[int, int, int]] = []
+
+    if region:
+        r_from, c_from = region[0], region[1]
+        r_to, c_to = region[0] + region[2], region[1] + region[3]
+    else:
+        r_from, c_from = 0, 0
+        r_to, c_to = max(len(old), len(new)), -1
+
+    for y in range(r_from, r_to):
+        a = old[y] if y < len(old) else ''
+        b = new[y] if y < len(new) else ''
+
+        if region:
+            a = a[c_from:c_to]
+            b = b[c_from:c_to]
+
+        if a == b:  # the most common case. no need to go char by char
+            continue
+
+        # lines are right-stripped, so the shorter one is padded back with spaces
+        width = max(len(a), len(b))
+        a = a.ljust(width)
+        b = b.ljust(width)
+
+        start = -1
+        for x in range(width):
+            if a[x] != b[x]:
+                if start == -1:
+                    start = x
+            elif start != -1:
+                spans.append((y, start + c_from, x + c_from))
+                start = -1
+
+        if start != -1:
+            spans.append((y, start + c_from, width + c_from))
+
+    return spans
+
+
 #####################################################################
 class x3270Script:
 
@@ -54,15 +178,54 @@ class x3270Script:
         else:
             self.__debug = level
 
+    #####################################################################
+    def set_timeout(self, timeout: float) -> None:
+        """
+        Sets the default deadline for every command
+        :param timeout: seconds
+        """
+        self.__timeout = timeout if timeout > 0 else DEFAULT_TIMEOUT
+
+    #####################################################################
+    def get_timeout(self) -> float:
+        """
+        Returns the default deadline for every command, seconds
+        """
+        return self.__timeout
+
+    #####################################################################
+    def set_reconnect(self, tries: int, backoff: float = 0.5) -> None:
+        """
+        Sets the reconnect policy used when a command times out or the connection drops
+        :param tries: number of reconnect attempts. 0 disables reconnecting
+        :param backoff: initial delay between attempts, seconds. Doubled on each attempt
+        """
+        self.__reconnect_tries = max(tries, 0)
+        self.__backoff = backoff
+
     #####################################################################
     def connected(self) -> bool:
+        """
+        Checks that the scripting port is alive and the terminal is connected to a host.
+        Does not leave unread replies behind.
+        """
         if not self.__sock:
             return False
 
-        try:
-            self.__sock.sendall(b"\r\n")
-        except socket.error:
-            return False
+        # the readable socket with nothing to read means the other side has closed it
+        if self.__sel.select(0):
+            try:
+                if self.__sock.recv(1, socket.MSG_PEEK) == b'':
+                    self.close()
+                    return False
+            except BlockingIOError:
+                pass
+            except socket.error:
+                self.close()
+                return False
+
+        if 'connected' not in self.__last_status:  # any command will give us the status
+            self.script_query("Query(ConnectionState)", timeout=5)
 
         if 'connected' in self.__last_status and self.__last_status['connected'] == 'Y':
             return True
@@ -75,26 +238,23 @@ class x3270Script:
         Connects to a terminal scripting port
         """
         # sanity check:
-        if self.__host != host or self.__port != port:
-            if self.connected():
-                try:
-                    self.__sock.close()
-                except socket.error as se:
-                    print(f"x3270 Socket closing problem {se}", file=sys.stderr)
+        if self.__sock and (self.__host != host or self.__port != port):
+            self.close()
 
-        if not self.__sock:
-            try:
-                self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            except socket.error as se:
-                print(f"x3270 Socket error {se}", file=sys.stderr)
-                return False
+        if self.__sock:
+            return True
 
         try:
-            self.__sock.connect((host, port))
+            self.__sock = socket.create_connection((host, port), timeout=self.__timeout)
         except socket.error as se:
             print(f"x3270 Connection error to {host}:{port} - {se}", file=sys.stderr)
+            self.__sock = None
             return False
 
+        self.__sock.setblocking(False)
+        self.__sel = selectors.DefaultSelector()
+        self.__sel.register(self.__sock, selectors.EVENT_READ)
+
         if self.__debug > 0:
             print(". x3270: Connected")
 
@@ -102,6 +262,47 @@ class x3270Script:
         self.__port = port
         return True
 
+    #####################################################################
+    def close(self) -> None:
+        """
+        Closes the connection to the terminal, forgetting all the replies still on the way
+        """
+        if self.__sel:
+            self.__sel.close()
+            self.__sel = None
+
+        if self.__sock:
+            try:
+                self.__sock.close()
+            except socket.error as se:
+                print(f"x3270 Socket closing problem {se}", file=sys.stderr)
+            self.__sock = None
+
+        self.__rbuf = bytearray()
+        self.__pending = 0
+        self.__stale = 0
+        self.__last_status = {}
+
+    #####################################################################
+    def reconnect(self) -> bool:
+        """
+        Re-establishes the connection with exponential backoff between attempts
+        :return: success
+        """
+        self.close()
+
+        delay = self.__backoff
+        for attempt in range(self.__reconnect_tries):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+
+            print(f"x3270: reconnecting to {self.__host}:{self.__port}, attempt {attempt + 1}", file=sys.stderr)
+            if self.connect(self.__port, self.__host):
+                return True
+
+        return False
+
     # --- Low-Level Communication Functions ---
     #####################################################################
     def send_line(self, cmd: str) -> bool:
@@ -114,13 +315,21 @@ class x3270Script:
             print("!ERROR: x3270: socket is not connected yet", file=sys.stderr)
             return False
 
+        if self.__pending == 0:
+            self.__drain()
+
         b = cmd.encode('ascii') + b"\r\n"
         try:
+            self.__sock.settimeout(self.__timeout)
             self.__sock.sendall(b)
+            self.__sock.setblocking(False)
         except socket.error as se:
             print(f"!ERROR: x3270: socket: {se}", file=sys.stderr)
+            self.close()
             return False
 
+        self.__pending += 1
+
         if self.__debug > 4:
             # Use repr() to show control characters clearly
             print("> x3270 sent: " + repr(b.decode('ascii').strip()))
@@ -172,7 +381,7 @@ class x3270Script:
                 errors += ',' + tpl[fi][0]
                 self.__last_status[tpl[fi][0]] = ' '
             else:
-                self.__last_status[tpl[fi][0]] = parsed[0]
+                self.__last_status[tpl[fi][0]] = parsed[fi]
 
         # 3: Connection State
         #    If connected to a host, contains the string 'C(hostname)'. Otherwise, the letter 'N'.
@@ -181,7 +390,7 @@ class x3270Script:
             self.__last_status['host'] = ''
         else:
             self.__last_status['connected'] = 'Y'
-            self.__last_status['host'] = self.__last_status['connstate'][2:-1]  # saving just in case
+            self.__last_status['host'] = parsed[3][2:-1]  # saving just in case
 
         # 5: Model Number (2-5)
         self.__last_status['model'] = parsed[5]
@@ -221,99 +430,200 @@ class x3270Script:
         return True
 
     #####################################################################
-    def read_answer(self) -> List[str]:
+    def __drain(self) -> None:
         """
-        Return terminal's response as a list of lines.
-        List ends with 'ok' or 'error'.
-        :return: list of lines
+        Throws away anything the terminal sent us without being asked, so it will not be taken
+        for the reply to the next command.
         """
-        answer: List[str] = []
-        line = b''
-
-        if not self.__sock:
-            print("!ERROR: x3270: socket is not connected yet", file=sys.stderr)
-            return answer
+        try:
+            while self.__sel.select(0):
+                chunk = self.__sock.recv(65536)
+                if not chunk:
+                    break
+                self.__rbuf += chunk
+        except (BlockingIOError, socket.error):
+            pass
+
+        if self.__rbuf:
+            if self.__debug > 2:
+                print(f". x3270: dropped {len(self.__rbuf)} stray bytes")
+            self.__rbuf = bytearray()
 
-        stage = 'data'
-        # The answer may contain a bunch of "data: " prefixed lines,
-        # then multi-fielded status line, and finally 'ok' or 'error'
+    #####################################################################
+    def __read_line(self, deadline: float) -> Optional[str]:
+        """
+        Reads one line from the terminal without blocking past the deadline.
+        :return: line without EOL or None on timeout
+        :raises ConnectionError: if the connection is lost
+        """
         while True:
-            try:
-                # Read one byte at a time until EOL ([CR]LF) is found
-                c = self.__sock.recv(1)  # Should be mildly ineffective, but we'll see
-            except (socket.error, EOFError) as se:
-                print(f"!ERROR: x3270: socket: {se}", file=sys.stderr)
-                # Add partial line if it exists before returning
-                if line:
-                    answer.append(line.decode('ascii', errors='ignore'))
-                return answer
+            eol = self.__rbuf.find(b'\n')
+            if eol != -1:
+                line = self.__rbuf[:eol].rstrip(b'\r').decode('ascii', errors='ignore')
+                del self.__rbuf[:eol + 1]
+                return line
 
-            if c == b'\x0d':  # CR
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+
+            if not self.__sel.select(remaining):
                 continue
 
-            if c != b'\x0a':  # not LF (end of line)
-                line += c
+            try:
+                chunk = self.__sock.recv(65536)
+            except BlockingIOError:
                 continue
+            except socket.error as se:
+                raise ConnectionError(se)
+
+            if not chunk:
+                raise ConnectionError("closed by the terminal")
+
+            self.__rbuf += chunk
+
+    #####################################################################
+    def __read_reply(self, deadline: float) -> Optional[List[str]]:
+        """
+        Reads one complete reply: "data: " prefixed lines, then multi-fielded status line, and finally 'ok' or 'error'
+        :return: list of data lines ending with 'ok' or 'error'. None on timeout
+        :raises ConnectionError: if the connection is lost
+        """
+        answer: List[str] = []
+        stage = 'data'
+
+        while True:
+            line = self.__read_line(deadline)
+            if line is None:
+                return None
 
-            # got a complete line here. May be empty
-            decoded_line = line.decode('ascii', errors='ignore')
             if self.__debug > 5:
-                print("<<<x3270: '" + decoded_line + "'")
+                print("<<<x3270: '" + line + "'")
 
             if stage == 'data':
-                if decoded_line[0:6] == "data: ":
-                    answer.append(decoded_line[6:])
-                else:
-                    stage = 'status'  # expect status lines
+                if line[0:5] == "data:":
+                    answer.append(line[6:])
+                    continue
 
-            elif stage == 'status':  # should be terminal status string
-                self.__process_status(decoded_line)
+                # the first line without prefix is the terminal status string
+                self.__process_status(line)
                 stage = 'final'
 
-            else:  # command execution status
-                if decoded_line == "ok" or decoded_line == "error":
-                    if self.__debug <= 5:
-                        print(f"< x3270 terminal reply status: '{decoded_line}'")
+            elif line == "ok" or line == "error":  # command execution status
+                if self.__debug > 3:
+                    print(f"< x3270 terminal reply status: '{line}'")
 
-                    answer.append(decoded_line)
+                answer.append(line)
+                return answer
+
+            else:
+                print(f"<? x3270 unexpected terminal reply line: '{line}'")
+
+    #####################################################################
+    def read_answer(self, timeout: Optional[float] = None) -> List[str]:
+        """
+        Return terminal's response as a list of lines.
+        List ends with 'ok' or 'error', or it is just [TIMEOUT] if the deadline has passed.
+        Replies to the earlier timed out commands are skipped first.
+        :param timeout: seconds. Default is set by set_timeout()
+        :return: list of lines. Empty if the connection is lost
+        """
+        if not self.__sock:
+            print("!ERROR: x3270: socket is not connected yet", file=sys.stderr)
+            return []
+
+        deadline = time.monotonic() + (timeout if timeout is not None else self.__timeout)
+
+        try:
+            while True:
+                answer = self.__read_reply(deadline)
+                if answer is None:  # this reply will come later, if ever
+                    break
+
+                self.__pending -= 1
+                if not self.__stale:
                     return answer
-                else:
-                    print(f"<? x3270 unexpected terminal reply line: '{decoded_line}'")
 
-            line = b''
+                self.__stale -= 1
 
-        return answer
+        except ConnectionError as ce:
+            print(f"!ERROR: x3270: socket: {ce}", file=sys.stderr)
+            if self.__reconnect_tries:
+                self.reconnect()
+            else:
+                self.close()
+            return []
+
+        print("!ERROR: x3270: timed out waiting for the terminal reply", file=sys.stderr)
+        self.__stale += 1
+
+        if self.__reconnect_tries:  # the terminal seems to be stuck
+            self.reconnect()
+
+        return [TIMEOUT]
 
     #####################################################################
-    def wait_for_unlock(self) -> None:
+    def discard_replies(self, count: int = 1) -> None:
+        """
+        Declares the replies to the last sent commands as not needed. They will be skipped when they come.
+        :param count: number of unread replies to skip
+        """
+        self.__stale = min(self.__stale + count, self.__pending)
+
+    #####################################################################
+    def wait_for_unlock(self, timeout: Optional[float] = None) -> str:
         """
         Waits for the 3270 keyboard to be unlocked.
-        :return: None
+        :param timeout: seconds. Default is set by set_timeout()
+        :return: 'ok' if unlocked, 'error' or TIMEOUT
         """
-        self.send_line("Wait(Unlock)")
+        if timeout is None:
+            timeout = self.__timeout
+
+        # the terminal-side timeout keeps us in sync: it replies with error instead of staying silent
+        self.send_line(f"Wait({max(int(timeout), 1)},Unlock)")
 
-        a = self.read_answer()
+        a = self.read_answer(timeout + 1)
 
         if a and a[-1] != 'ok':
             print("!x3270 Error waiting for unlock. The response is: ", file=sys.stderr)
             for r in a:
                 print(">", r, file=sys.stderr)
 
+        return a[-1] if a else 'error'
+
     #####################################################################
-    def script_cmd(self, cmd: str) -> str:
+    def script_cmd(self, cmd: str, timeout: Optional[float] = None) -> str:
         """
-        Sends a simple script command to the terminal and returns the status ('ok' or 'error').
+        Sends a simple script command to the terminal and returns the status ('ok', 'error' or TIMEOUT).
         :param cmd: The command text to send to the terminal.
+        :param timeout: seconds for the whole command. Default is set by set_timeout()
         :return: terminal's or remote answer
         """
+        a = self.script_query(cmd, timeout)
+
+        return a[-1] if a else 'error'
+
+    #####################################################################
+    def script_query(self, cmd: str, timeout: Optional[float] = None) -> List[str]:
+        """
+        Sends a script command to the terminal and returns the whole answer, including data lines.
+        :param cmd: The command text to send to the terminal.
+        :param timeout: seconds for the whole command, including the wait for unlock. Default is set by set_timeout()
+        :return: list of lines, ending with 'ok', 'error' or TIMEOUT. Empty on communication error
+        """
         if self.__debug:
-            print(f". x3270 script_cmd('{cmd}')")
+            print(f". x3270 script_query('{cmd}')")
 
-        self.wait_for_unlock()
-        self.send_line(cmd)
-        a = self.read_answer()
+        deadline = time.monotonic() + (timeout if timeout is not None else self.__timeout)
 
-        return a[-1] if a else 'error'
+        if self.wait_for_unlock(deadline - time.monotonic()) == TIMEOUT:
+            return [TIMEOUT]
+
+        if not self.send_line(cmd):
+            return []
+
+        return self.read_answer(max(deadline - time.monotonic(), 0.1))
 
     #####################################################################
     def get_screen_size(self) -> Tuple[int, int]:
@@ -321,7 +631,7 @@ class x3270Script:
         Queries and return screen rows and cols.
         :return: tuple: rows, cols or -1,-1 in case of error
         """
-        a = self.script_cmd("Query(ScreenCurSize)")
+        a = self.script_query("Query(ScreenCurSize)")
 
         r = -1
         c = -1
@@ -339,8 +649,23 @@ class x3270Script:
             print("x3270: Error getting screen size.", file=sys.stderr)
             return r, c
 
+        self.__last_status['rows'] = r
+        self.__last_status['cols'] = c
         return r, c
 
+    #####################################################################
+    def __cur_screen_size(self) -> Tuple[int, int]:
+        """
+        Returns screen rows and cols known from the last terminal status, querying only if unknown.
+        :return: tuple: rows, cols or -1,-1 in case of error
+        """
+        r = self.__last_status.get('rows', -1)
+        c = self.__last_status.get('cols', -1)
+        if r > 0 and c > 0:
+            return r, c
+
+        return self.get_screen_size()
+
     #####################################################################
     # --- Advanced functions ---
     #####################################################################
@@ -349,56 +674,157 @@ class x3270Script:
         Retrieves the screen content and return as a list of strings.
         :return: list[str]. Empty in case of error
         """
-        screen = []
-        r, c = self.get_screen_size()
-        if r == -1:
-            return screen
+        a = self.script_query("Snap(Save)")
+        if not a or a[-1] != 'ok':
+            return []
 
-        self.send_line("Snap(Save)")
-        self.wait_for_unlock()
-        self.send_line("Snap(Ascii)")
+        a = self.script_query("Snap(Ascii)")
+        if not a or a[-1] != 'ok':
+            return []
 
-        a = self.read_answer()
+        # Map and clean up the encasing dots and spaces from the 3270 script output
+        return [clean_screen_line(line) for line in a[:-1]]  # Exclude the 'ok' status line
 
+    #####################################################################
+    def get_screen_region(self, row: int, col: int, rows: int, cols: int) -> List[str]:
+        """
+        Retrieves only a rectangle of the screen, using the positional Ascii(row,col,rows,cols) form.
+        Much cheaper than get_screen_content when only a header or a field is needed.
+        :param row: top row (0-based)
+        :param col: left column (0-based)
+        :param rows: number of rows
+        :param cols: number of columns
+        :return: list[str], one per row. Empty in case of error
+        """
+        if row < 0 or col < 0 or rows <= 0 or cols <= 0:
+            return []
+
+        a = self.script_query(f"Ascii({row},{col},{rows},{cols})")
         if not a or a[-1] != 'ok':
-            return screen
+            return []
 
-        # Map and clean up the encasing dots and spaces from the 3270 script output
-        for line in a[:-1]:  # Exclude the 'ok' status line
-            match = re.match(r'^\s*\.+\s(.+?)\s*\.+\s*$', line)
-            if match:
-                screen.append(match.group(1).rstrip())
+        return [clean_screen_line(line) for line in a[:-1]]
+
+    #####################################################################
+    def get_screen_rows(self, first: int, count: int = 1) -> List[str]:
+        """
+        Retrieves full-width screen rows.
+        :param first: first row (0-based)
+        :param count: number of rows. Zero or negative means up to the end of screen less that many rows,
+            i.e. -1 will skip the last (message) row
+        :return: list[str]. Empty in case of error
+        """
+        r, c = self.__cur_screen_size()
+        if r == -1:
+            return []
+
+        if count <= 0:
+            count = r - first + count
+
+        if first + count > r:
+            count = r - first
+
+        return self.get_screen_region(first, 0, count, c)
+
+    #####################################################################
+    def screen_diff(self, screen: Optional[List[str]] = None,
+                    region: Optional[Tuple[int, int, int, int]] = None) -> List[Tuple[int, int, int]]:
+        """
+        Compares the screen to the previous snapshot taken by this method and remembers the new one.
+        :param screen: already fetched screen content. Will be fetched if None
+        :param region: optional (row, col, rows, cols) rectangle to limit the comparison to
+        :return: list of changed (row, start col, end col) spans. Empty if nothing changed
+        """
+        if screen is None:
+            screen = self.get_screen_content()
+
+        spans = diff_screens(self.__last_screen, screen, region)
+        self.__last_screen = screen
+
+        if self.__debug > 2 and spans:
+            print(f". x3270 screen_diff: {len(spans)} changed spans")
+
+        return spans
+
+    #####################################################################
+    def last_screen(self) -> List[str]:
+        """
+        Returns the last snapshot taken by screen_diff() or wait_for_change() without talking to the terminal.
+        """
+        return self.__last_screen
+
+    #####################################################################
+    def wait_for_change(self, region: Optional[Tuple[int, int, int, int]] = None,
+                        timeout: float = 10) -> List[Tuple[int, int, int]]:
+        """
+        Blocks until the host changes the screen (or the region of it) compared to the last snapshot.
+        Uses the emulator's Wait(Output) instead of polling the screen.
+        :param region: optional (row, col, rows, cols) rectangle to watch. Changes elsewhere are ignored
+            and only this rectangle is read back from the terminal
+        :param timeout: seconds to wait
+        :return: list of changed (row, start col, end col) spans. Empty on timeout
+        """
+        if region:
+            r, c, rows, cols = region
+            if self.__last_screen:
+                base = [line[c:c + cols].rstrip() for line in self.__last_screen[r:r + rows]]
             else:
-                # Fallback: keep the line
-                screen.append(line)
+                base = self.get_screen_region(r, c, rows, cols)
+        elif not self.__last_screen:  # need something to compare against
+            self.screen_diff()
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = int(deadline - time.monotonic() + 0.999)
+            if remaining <= 0:
+                return []
+
+            if self.script_cmd(f"Wait({remaining},Output)", timeout=remaining + 5) != 'ok':
+                return []  # timed out or disconnected
 
-        return screen
+            if not region:
+                spans = self.screen_diff()
+                if spans:
+                    return spans
+                continue
+
+            current = self.get_screen_region(r, c, rows, cols)
+            spans = [(y + r, x1 + c, x2 + c) for y, x1, x2 in diff_screens(base, current)]
+            if spans:
+                return spans
+
+            base = current
 
     #####################################################################
-    def find_text(self, txt: str, xIsAfter: bool = False) -> Tuple[int, int]:
+    def find_text(self, txt: str, xIsAfter: bool = False, screen: Optional[List[str]] = None) -> Tuple[int, int]:
         """
         Will find (regexp) data on screen, returning row,col tuple of the beginning of found text
         -1, -1 if not found. If xIsAfter is True then cols returned position after the text
+        :param screen: already fetched screen content. Will be fetched if None
         """
-        screen = self.get_screen_content()
-        r, c = self.get_screen_size()
+        if screen is None:
+            screen = self.get_screen_content()
 
-        from_zero_col = True if txt[0] == '^' else False
-        if xIsAfter:
-            txt = '(' + txt + ')'
+        rx = compile_patterns((txt,))[0]
+        for y, line in enumerate(screen):
+            if m := rx.search(line):
+                return y, m.end() if xIsAfter else m.start()
 
-        y = 0
-        while y != r:
-            if from_zero_col:
-                if m := re.search(txt, screen[y]):
-                    return y, len(m.group(1)) if xIsAfter else 0
-            else:
-                if m := re.search(r'(.+?)' + txt, screen[y]):
-                    return y, len(m.group(1)) + (len(m.group(2)) if xIsAfter else 0)
+        return -1, -1
 
-            y += 1
+    #####################################################################
+    def find_all(self, patterns: List[str],
+                 screen: Optional[List[str]] = None) -> List[Tuple[int, int, int, int]]:
+        """
+        Finds all matches of several regexps at once. See search_screen() for the details.
+        :param patterns: regexps
+        :param screen: already fetched screen content. Will be fetched if None
+        :return: list of (pattern index, row, start col, end col)
+        """
+        if screen is None:
+            screen = self.get_screen_content()
 
-        return -1, -1
+        return search_screen(screen, patterns)
 
     #####################################################################
     def field_fill(self, x: int, y: int, content: str) -> Optional[str]:
@@ -409,23 +835,84 @@ class x3270Script:
         :param content: string to put
         :return: old value
         """
-        r, c = self.get_screen_size()
-        if r == -1 or c < x or x < 0 or r < y or y < 0:
+        old = self.fill_form({(x, y): content}, submit=False)
+
+        return old[(x, y)] if old is not None else None
+
+    #####################################################################
+    def fill_form(self, fields: Dict[Union[str, Tuple[int, int]], str],
+                  submit: bool = True) -> Optional[Dict[Union[str, Tuple[int, int]], str]]:
+        """
+        Fills several screen fields in a single host interaction.
+        All targets are resolved from one screen snapshot, then cursor moves, erases and typing
+        for every field are sent as one batch of keystrokes, optionally followed by Enter.
+        :param fields: {target: value}. Target is either a (row, col) tuple (0-based) of the field start,
+            or a regexp of the field label. The field is assumed to start after the label's attribute byte,
+            like 'Command ===>' -> column 15
+        :param submit: press Enter after filling
+        :return: {target: old value} read from the same snapshot or None on error.
+            Old value is the text up to the next double space, as the field length is not known here
+        """
+        screen = self.get_screen_content()
+        if not screen:
             return None
 
-        self.script_cmd(f"MoveCursor({x},{y})")
-        old_val = self.script_cmd("AsciiField")
-        self.script_cmd(f'String "{content}"')
+        old: Dict[Union[str, Tuple[int, int]], str] = {}
+        keys: List[str] = []
+
+        # resolving all the labels in one pass. The first match of each one is used
+        labels = [t for t in fields if isinstance(t, str)]
+        label_pos: Dict[str, Tuple[int, int]] = {}
+        if labels:
+            for i, y, start, end in search_screen(screen, labels):
+                label_pos.setdefault(labels[i], (y, end + 1))  # skipping the attribute byte
+
+        for target, value in fields.items():
+            if isinstance(target, str):
+                r, c = label_pos.get(target, (-1, -1))
+            else:
+                r, c = target
+
+            if r < 0 or r >= len(screen) or c < 0:
+                print(f"x3270 fill_form: field {target!r} is not on screen", file=sys.stderr)
+                return None
+
+            old[target] = screen[r][c:].split('  ', 1)[0].strip()
+
+            keys.append(f"MoveCursor({r},{c})")
+            keys.append("EraseEOF")
+            if value:
+                escaped = value.replace('\\', '\\\\').replace('"', '\\"')
+                keys.append(f'String("{escaped}")')
+
+        if submit:
+            keys.append("Enter")
+
+        if not keys:
+            return old
+
+        a = self.script_query(' '.join(keys))
+        if not a or a[-1] != 'ok':
+            print("x3270 fill_form: terminal did not accept the input", file=sys.stderr)
+            return None
 
-        return old_val
+        return old
 
     #####################################################################
     def __init__(self, host, port):
-        self.__sock: socket = None
+        self.__sock: Optional[socket.socket] = None
+        self.__sel: Optional[selectors.BaseSelector] = None
         self.__host = ''
         self.__port = -1
         self.__debug: int = 0
+        self.__timeout: float = DEFAULT_TIMEOUT
+        self.__reconnect_tries: int = 0
+        self.__backoff: float = 0.5
+        self.__rbuf = bytearray()  # received, but not yet parsed
+        self.__pending: int = 0  # replies expected from the terminal
+        self.__stale: int = 0  # how many of them nobody waits for anymore
         self.__last_status = {}
+        self.__last_screen: List[str] = []
         self.connect(port, host)
 
 
@@ -0,0 +1,473 @@
+"""
+    This module is a part of z/OS toolset interacting with 3270 terminal emulator
+by https://x3270.bgp.nu/ team. You need to enable scripting port for it to work.
+    The function is to retrieve job output from SDSF: locate the job, open each of its DDs
+and stream the spool lines to local files, paging a full screen at a time.
+Lines wider than the screen are glued from the strips scrolled right.
+Active jobs can be tailed, reading only the lines that appear below the end of data.
+This module depends on x3270ISPF and x3270Script modules of the same author.
+Written by Andrej Pakhutin (pakhutin@gmail.com)
+"""
+
+import os
+import re
+import sys
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Dict, Union
+from x3270scripting import x3270Script, search_screen, DEFAULT_TIMEOUT
+from x3270ispf import x3270ISPF, recognize_panel
+from record_sinks import open_sink, RecordSink
+
+TOP_OF_DATA_RE = re.compile(r'\*{10,}\s*TOP OF DATA', re.IGNORECASE)
+BOTTOM_OF_DATA_RE = re.compile(r'\*{10,}\s*BOTTOM OF DATA', re.IGNORECASE)
+
+# JES logs and SYSOUT are usually 133 wide: 132 columns and the carriage control
+SPOOL_LRECL = 133
+
+# Column headers of the status (ST) and job data set (?) panels
+ST_COLUMNS = [r'\bNP\b', r'\bJOBNAME\b', r'\bJobID\b']
+JDS_COLUMNS = [r'\bNP\b', r'\bDDNAME\b', r'\bStepName\b', r'\bProcStep\b']
+
+
+#####################################################################
+def find_columns(screen: List[str], columns: List[str]) -> Tuple[int, List[int]]:
+    """
+    Finds the row with all of the column headers
+    :param screen: screen content
+    :param columns: header regexps
+    :return: header row and the start columns of the headers. -1, [] if not found
+    """
+    rows: Dict[int, Dict[int, int]] = {}
+    for i, y, start, end in search_screen(screen, columns):
+        rows.setdefault(y, {}).setdefault(i, start)
+
+    for y in sorted(rows):
+        if len(rows[y]) == len(columns):
+            return y, [rows[y][i] for i in range(len(columns))]
+
+    return -1, []
+
+
+#####################################################################
+def job_number(jobid: str) -> int:
+    """
+    Returns the number part of a job id, comparable across JOBnnnnn and Jnnnnnnn forms. -1 if there is none
+    """
+    digits = re.sub(r'\D', '', jobid)
+    return int(digits) if digits else -1
+
+
+#####################################################################
+class x3270SDSF:
+    def __init__(self, aispf: x3270ISPF, entry_cmd: str = 'SDSF'):
+        """
+        :param aispf: ISPF session to work in
+        :param entry_cmd: ISPF command that starts SDSF at the site. Can be like '=M.5' or 'TSO SDSF'
+        """
+        self.__ispf: x3270ISPF = aispf
+        self.__termscript: x3270Script = aispf.termscript()
+        self.__entry_cmd = entry_cmd
+        self.__debug: int = 0
+
+    def debug_level(self, level: int) -> None:
+        if level < 0:
+            self.__debug = 0
+        elif level > 9:
+            self.__debug = 9
+        else:
+            self.__debug = level
+
+    #####################################################################
+    def open(self) -> bool:
+        """
+        Enters SDSF if we're not there yet
+        """
+        if str(self.__ispf.current_panel()['panel']).startswith('SDSF'):
+            return True
+
+        if not self.__ispf.command(self.__entry_cmd):
+            return False
+
+        return self.__ispf.wait_for_panel('SDSF') is not None
+
+    #####################################################################
+    def __command(self, command: str, *panels: str) -> Optional[Dict[str, Union[str, int]]]:
+        """
+        Issues SDSF command and waits for the expected panel
+        """
+        if not self.__ispf.command(command):
+            return None
+
+        return self.__ispf.wait_for_panel(*(panels or ('SDSF',)))
+
+    #####################################################################
+    def find_job(self, jobname: str, jobid: str = '') -> Optional[Tuple[str, int, int]]:
+        """
+        Locates the job on the status panel.
+        :param jobname: job name
+        :param jobid: job id. The most recent job with this name is taken if empty
+        :return: job id, screen row and NP column or None if not found
+        """
+        if not self.open():
+            return None
+
+        if (not self.__command('ST') or not self.__command('OWNER *')
+                or not self.__command(f'PREFIX {jobname}')):
+            return None
+
+        screen = self.__termscript.get_screen_content()
+        hrow, cols = find_columns(screen, ST_COLUMNS)
+        if hrow == -1:
+            print("sdsf.find_job(): cannot find the status panel columns", file=sys.stderr)
+            return None
+
+        np_col, name_col, id_col = cols
+        found: Optional[Tuple[str, int, int]] = None
+
+        for y in range(hrow + 1, len(screen)):
+            line = screen[y]
+            if line[name_col:id_col].strip().upper() != jobname.upper():
+                continue
+
+            jid = line[id_col:id_col + 8].strip()
+            if jobid and jid.upper() != jobid.upper():
+                continue
+
+            if not found or job_number(jid) > job_number(found[0]):  # the most recent one: higher number
+                found = (jid, y, np_col)
+
+        if not found:
+            print(f"sdsf.find_job(): job {jobname} {jobid} not found", file=sys.stderr)
+
+        return found
+
+    #####################################################################
+    def list_dds(self, jobname: str, jobid: str = '') -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Opens the job data set panel of the job and lists its DDs.
+        :return: job id and list of {'ddname', 'stepname', 'procstep', 'dsid'}. Empty list if not found
+        """
+        job = self.find_job(jobname, jobid)
+        if not job:
+            return jobid, []
+
+        jobid = job[0]
+        if self.__termscript.fill_form({(job[1], job[2]): '?'}) is None:
+            return jobid, []
+
+        if not self.__ispf.wait_for_panel('SDSF'):
+            return jobid, []
+
+        dds: List[Dict[str, str]] = []
+        seen = set()
+        while True:
+            screen = self.__termscript.get_screen_content()
+            hrow, cols = find_columns(screen, JDS_COLUMNS)
+            if hrow == -1:
+                print("sdsf.list_dds(): cannot find the job data set panel columns", file=sys.stderr)
+                return jobid, []
+
+            new = 0
+            for y in range(hrow + 1, len(screen)):
+                dd = self.__parse_dd(screen[y], cols)
+                if dd and dd['dsid'] not in seen:
+                    seen.add(dd['dsid'])
+                    dds.append(dd)
+                    new += 1
+
+            if not new or not self.__command(f'DOWN {len(screen) - hrow - 1}'):
+                break
+
+        self.__command('TOP')
+
+        return jobid, dds
+
+    #####################################################################
+    @staticmethod
+    def __parse_dd(line: str, cols: List[int]) -> Optional[Dict[str, str]]:
+        _, dd_col, step_col, proc_col = cols
+
+        ddname = line[dd_col:step_col].strip()
+        m = re.match(r'(\S*)\s+(\d+)\b', line[proc_col:])
+        if not ddname or not m:
+            return None
+
+        return {'ddname': ddname, 'stepname': line[step_col:proc_col].strip(),
+                'procstep': m.group(1), 'dsid': m.group(2)}
+
+    #####################################################################
+    def open_dd(self, dsid: str) -> Optional[Dict[str, Union[str, int]]]:
+        """
+        Selects the DD on the job data set panel for browsing.
+        :param dsid: DSID of the DD
+        :return: the output display panel or None on error
+        """
+        while True:
+            screen = self.__termscript.get_screen_content()
+            hrow, cols = find_columns(screen, JDS_COLUMNS)
+            if hrow == -1:
+                print("sdsf.open_dd(): not on the job data set panel", file=sys.stderr)
+                return None
+
+            for y in range(hrow + 1, len(screen)):
+                dd = self.__parse_dd(screen[y], cols)
+                if dd and dd['dsid'] == dsid:
+                    if self.__termscript.fill_form({(y, cols[0]): 'S'}) is None:
+                        return None
+                    return self.__ispf.wait_for_panel('SDSF_OUTPUT')
+
+            if BOTTOM_OF_DATA_RE.search(' '.join(screen[hrow + 1:])) or \
+                    not self.__command(f'DOWN {len(screen) - hrow - 1}'):
+                print(f"sdsf.open_dd(): DSID {dsid} not found", file=sys.stderr)
+                return None
+
+    #####################################################################
+    def __keys(self, panel: Dict[str, Union[str, int]], *commands: str) -> bool:
+        """
+        Types the commands on the command line one after another in a single host interaction.
+        Unlike ISPF command(), the screen is not read to find the command line
+        :param panel: the current panel, for the command line position
+        :param commands: commands. Empty one just presses Enter, refreshing the screen
+        """
+        wait = f"Wait({max(int(self.__termscript.get_timeout()), 1)},Unlock)"
+        keys: List[str] = []
+        for command in commands:
+            if keys:
+                keys.append(wait)
+
+            keys.append(f"MoveCursor({panel['cmd_row']},{panel['cmd_col']}) EraseEOF")
+            if command:
+                keys.append(f'String("{command}")')
+            keys.append("Enter")
+
+        a = self.__termscript.script_query(' '.join(keys))
+        if not a or a[-1] != 'ok':
+            print(f"sdsf: {', '.join(commands)} failed", file=sys.stderr)
+            return False
+
+        return True
+
+    #####################################################################
+    def __read_page(self, top: int) -> Optional[Tuple[Dict[str, Union[str, int]], List[str]]]:
+        """
+        Reads the output display from the header row down
+        :param top: header row
+        :return: panel fields (rows are relative to the header) and the data rows or None if not in output display
+        """
+        rows = self.__termscript.get_screen_rows(top, 0)
+        panel = recognize_panel(rows)
+        if panel['panel'] != 'SDSF_OUTPUT':
+            print(f"sdsf: not in output display, but {panel['panel']} {panel.get('message', '')}", file=sys.stderr)
+            return None
+
+        return panel, rows[int(panel['data_row']):]
+
+    #####################################################################
+    def stream_output(self, sink: RecordSink, tail: bool = False, lrecl: int = SPOOL_LRECL,
+                      poll: float = 5, idle_limit: float = 300) -> int:
+        """
+        Streams the spool lines of the currently displayed output to the sink, a full page at a time.
+        Lines wider than the screen are glued from the strips scrolled right, placed by the COLUMNS range
+        of the header. Lines are tracked by their numbers from the panel header, so nothing is saved twice.
+        :param sink: where to write the lines
+        :param tail: keep polling for the new lines at the end of data, like for an active job
+        :param lrecl: spool record length. The strips are read up to this column or until one comes blank
+        :param poll: seconds between polls when tailing
+        :param idle_limit: stop tailing after that many seconds without new lines
+        :return: number of lines saved or -1 if the output could not be read to the end
+        """
+        panel = self.__ispf.current_panel()
+        if panel['panel'] != 'SDSF_OUTPUT':
+            print(f"sdsf.stream_output(): not in output display, but {panel['panel']}", file=sys.stderr)
+            return -1
+
+        top = int(panel.get('header_row', 0))
+        data_row = top + int(panel['data_row'])
+        next_no = 1
+        saved = 0
+        idle_since = time.monotonic()
+        shifted = False  # scrolled right, the next scroll goes LEFT MAX first
+
+        page = self.__read_page(top)
+        while True:
+            if page is None:
+                return -1
+
+            header, lines = page
+            col, col_to = int(header['col']), int(header['col_to'])
+            width = col_to - col + 1
+
+            while col_to < lrecl:
+                if not self.__keys(panel, f"RIGHT {width}"):
+                    return -1
+
+                shifted = True
+                if (strip := self.__read_page(top)) is None:
+                    return -1
+
+                s_header, s_lines = strip
+                if int(s_header['col_to']) <= col_to:  # SDSF does not go any further
+                    print(f"! sdsf: lines are cut at column {col_to}, the output is {lrecl} wide", file=sys.stderr)
+                    lrecl = col_to  # not trying again on the next pages
+                    break
+
+                offset = int(s_header['col']) - col
+                lines = [line.ljust(offset)[:offset] + s_line for line, s_line in zip(lines, s_lines)]
+                col_to = int(s_header['col_to'])
+
+                if not any(s_line.strip() for s_line in s_lines):  # nothing that wide on this page
+                    break
+
+            line_no = int(header['line'])
+            at_bottom = -1
+
+            for y, line in enumerate(lines):
+                if TOP_OF_DATA_RE.search(line):
+                    line_no += 1
+                    continue
+
+                if BOTTOM_OF_DATA_RE.search(line):
+                    at_bottom = y
+                    break
+
+                if line_no >= next_no:
+                    sink.write_record(line.rstrip())
+                    saved += 1
+                    next_no = line_no + 1
+                    idle_since = time.monotonic()
+
+                line_no += 1
+
+            if at_bottom == -1:  # the whole page was data: the next one, please
+                if not self.__keys(panel, *(['LEFT MAX'] if shifted else []), f"DOWN {len(lines)}"):
+                    return -1
+
+                shifted = False
+                page = self.__read_page(top)
+                continue
+
+            # Tailing: refreshing and reading only the rows below the last known line
+            while True:
+                if not tail or time.monotonic() - idle_since > idle_limit:
+                    return saved
+
+                time.sleep(poll)
+                if not self.__keys(panel, 'LEFT MAX' if shifted else ''):
+                    return -1
+
+                shifted = False
+                rows = self.__termscript.get_screen_rows(data_row + at_bottom, 0)
+                if rows and not BOTTOM_OF_DATA_RE.search(rows[0]):
+                    break
+
+            if self.__debug:
+                print(f". SDSF: new lines after {next_no - 1}")
+
+            page = self.__read_page(top)
+
+    #####################################################################
+    def retrieve_job(self, jobname: str, jobid: str = '', out_dir: str = '.', tail: bool = False,
+                     lrecl: int = SPOOL_LRECL) -> Dict[str, int]:
+        """
+        Saves all of the job DDs into out_dir/JOBNAME.JOBID/STEPNAME.DDNAME.DSID.txt files.
+        :param jobname: job name
+        :param jobid: job id. The most recent job with this name is taken if empty
+        :param out_dir: base directory
+        :param tail: keep tailing the last DD, for the active jobs
+        :param lrecl: spool record length
+        :return: {file name: lines saved}. The DDs that could not be read to the end are not included
+        """
+        jobid, dds = self.list_dds(jobname, jobid)
+        if not dds:
+            return {}
+
+        job_dir = os.path.join(out_dir, f"{jobname}.{jobid}".upper())
+        os.makedirs(job_dir, exist_ok=True)
+
+        result: Dict[str, int] = {}
+        for i, dd in enumerate(dds):
+            fname = os.path.join(job_dir, '.'.join(p for p in (dd['stepname'], dd['ddname'], dd['dsid']) if p) + '.txt')
+
+            if not self.open_dd(dd['dsid']):
+                continue
+
+            sink = open_sink(fname)
+            if not sink:
+                return result
+
+            with sink:
+                lines = self.stream_output(sink, tail and i == len(dds) - 1, lrecl)
+
+            if lines == -1:
+                print(f"! {jobname} {jobid} {dd['ddname']}: incomplete, {sink.records} lines -> {fname}",
+                      file=sys.stderr)
+            else:
+                result[fname] = lines
+                print(f"+ {jobname} {jobid} {dd['ddname']}: {lines} lines -> {fname}")
+
+            self.__termscript.script_cmd('PF(3)')  # back to the job data set panel
+            self.__ispf.wait_for_panel('SDSF')
+
+        return result
+
+
+#####################################################################
+def retrieve_jobs(sessions: List[Tuple[str, int]], jobs: List[Tuple[str, str]], out_dir: str = '.',
+                  tail: bool = False, debug: int = 0, timeout: float = DEFAULT_TIMEOUT, reconnect: int = 0,
+                  lrecl: int = SPOOL_LRECL) -> Dict[str, int]:
+    """
+    Retrieves the output of several jobs, spreading them over several terminal sessions.
+    Every session should be logged on to ISPF.
+    :param sessions: (host, port) of the terminal scripting ports
+    :param jobs: (jobname, jobid). jobid may be empty for the most recent job
+    :param out_dir: base directory
+    :param tail: keep tailing the active jobs
+    :param debug: debug level
+    :param timeout: default deadline for every terminal command, seconds
+    :param reconnect: number of reconnect attempts when a command times out or the connection drops
+    :param lrecl: spool record length
+    :return: {file name: lines saved}
+    """
+    todo: queue.Queue = queue.Queue()
+    for job in jobs:
+        todo.put(job)
+
+    def worker(host: str, port: int) -> Dict[str, int]:
+        done: Dict[str, int] = {}
+        term = x3270Script(host, port)
+        term.debug_level(debug)
+        term.set_timeout(timeout)
+        term.set_reconnect(reconnect)
+        if not term.connected():
+            print(f"! Session {host}:{port} is not connected", file=sys.stderr)
+            return done
+
+        ispf = x3270ISPF(term)
+        ispf.debug_level(debug)
+        sdsf = x3270SDSF(ispf)
+        sdsf.debug_level(debug)
+
+        while True:
+            try:
+                jobname, jobid = todo.get_nowait()
+            except queue.Empty:
+                break
+            done.update(sdsf.retrieve_job(jobname, jobid, out_dir, tail, lrecl))
+
+        term.close()
+        return done
+
+    result: Dict[str, int] = {}
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        for r in pool.map(lambda s: worker(*s), sessions):
+            result.update(r)
+
+    return result
+
+
+#####################################################################
+if __name__ == "__main__":
+    print("x3270 SDSF: This module should only be imported")
+    sys.exit(1)